@@ -0,0 +1,247 @@
+"""Microbenchmarks of the miIO codec with a stored baseline.
+
+Covers parsing hello packets and building and parsing data packets with the
+construct and the struct-based codec, building hello packets, encryption
+and decryption at realistic payload sizes, request creation from parameters
+and from request templates and decoding the responses of a full
+``DreameVacuum.status()`` poll.
+
+Run from the repository root::
+
+    python benchmarks/codec.py            # compare against benchmarks/baseline.json
+    python benchmarks/codec.py --save     # record a new baseline
+    python benchmarks/codec.py --capture FILE --token HEX  # add captured traffic
+
+Comparing exits with status 1 when a benchmark lost more than the threshold of
+its baseline throughput. Baselines are specific to the machine they were
+recorded on, record one before comparing on another machine.
+
+With ``--capture``, parsing all responses of a capture recorded with
+``Device.start_capture`` is timed as well.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(__file__), "..", "custom_components", "xiaomi_vacuum"),
+)
+
+from miio.capture import RECV, read_capture  # noqa: E402
+from miio.dreamevacuum import DreameVacuum  # noqa: E402
+from miio.miioprotocol import HELLO_BYTES, MiIOProtocol  # noqa: E402
+from miio.protocol import FastMessage, Message, Utils  # noqa: E402
+from miio.request_templates import RequestTemplate  # noqa: E402
+from miio.simulator import DeviceSimulator  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+TOKEN = bytes.fromhex("00112233445566778899aabbccddeeff")
+DEVICE_ID = bytes.fromhex("0badf00d")
+TS = datetime.datetime(2021, 1, 1)
+# payload sizes of an action, a get_properties request and a full response
+PAYLOAD_SIZES = (64, 512, 1440)
+MAX_PROPERTIES = 15
+
+
+def _message(value) -> Dict:
+    header = {"length": 0, "unknown": 0, "device_id": DEVICE_ID, "ts": TS}
+    return {"data": {"value": value}, "header": {"value": header}, "checksum": 0}
+
+
+def _hello() -> Dict:
+    return {**_message(b""), "checksum": TOKEN}
+
+
+VACUUM = DreameVacuum(token=TOKEN.hex())
+
+
+def _properties() -> List[Dict]:
+    return list(VACUUM._mapping_properties())
+
+
+def _request() -> Dict:
+    return {"id": 4242, "method": "get_properties", "params": _properties()[:15]}
+
+
+def _status_responses() -> List[bytes]:
+    """Return the responses of the simulated device to a status poll."""
+    simulator = DeviceSimulator(TOKEN)
+    properties = _properties()
+    responses = []
+    for i in range(0, len(properties), MAX_PROPERTIES):
+        request = {
+            "id": i + 1,
+            "method": "get_properties",
+            "params": properties[i : i + MAX_PROPERTIES],
+        }
+        packet = FastMessage.build(_message(request), token=TOKEN)
+        responses.append(simulator.handle_packet(packet))
+    return responses
+
+
+def _decode_status(responses: List[bytes]):
+    values = []
+    for response in responses:
+        values.extend(FastMessage.parse(response, token=TOKEN).data.value["result"])
+    return VACUUM._create_status(values)
+
+
+def _decode_capture(responses: List[bytes], token: bytes) -> None:
+    for response in responses:
+        FastMessage.parse(response, token=token)
+
+
+def benchmarks(
+    capture: str = None, token: bytes = TOKEN
+) -> List[Tuple[str, Callable[[], object]]]:
+    """Return the benchmarks as pairs of name and function to time.
+
+    :param capture: Capture file whose responses are decoded by an extra benchmark
+    :param token: Token of the captured device
+    """
+    hello = _hello()
+    data = _message(_request())
+    packet = Message.build(data, token=TOKEN)
+    protocol = MiIOProtocol("127.0.0.1", TOKEN.hex())
+    properties = _properties()[:15]
+    template = RequestTemplate.build("get_properties", properties)
+    responses = _status_responses()
+
+    cases = [
+        ("message_parse_hello", lambda: Message.parse(HELLO_BYTES)),
+        ("message_build_data", lambda: Message.build(data, token=TOKEN)),
+        ("message_parse_data", lambda: Message.parse(packet, token=TOKEN)),
+        ("fast_build_hello", lambda: FastMessage.build(hello)),
+        ("fast_parse_hello", lambda: FastMessage.parse(HELLO_BYTES)),
+        ("fast_build_data", lambda: FastMessage.build(data, token=TOKEN)),
+        ("fast_parse_data", lambda: FastMessage.parse(packet, token=TOKEN)),
+    ]
+    for size in PAYLOAD_SIZES:
+        plaintext = b"x" * size
+        ciphertext = Utils.encrypt(plaintext, TOKEN)
+        cases.append(("encrypt_%s" % size, lambda p=plaintext: Utils.encrypt(p, TOKEN)))
+        cases.append(
+            ("decrypt_%s" % size, lambda c=ciphertext: Utils.decrypt(c, TOKEN))
+        )
+    cases.append(
+        (
+            "create_request",
+            lambda: protocol._create_request("get_properties", properties),
+        )
+    )
+    cases.append(
+        (
+            "create_request_template",
+            lambda: protocol._create_request("get_properties", template),
+        )
+    )
+    cases.append(
+        (
+            "build_request_template",
+            lambda: FastMessage.build(
+                _message(protocol._create_request("get_properties", template)),
+                token=TOKEN,
+            ),
+        )
+    )
+    cases.append(
+        (
+            "build_request",
+            lambda: FastMessage.build(
+                _message(protocol._create_request("get_properties", properties)),
+                token=TOKEN,
+            ),
+        )
+    )
+    cases.append(("status_decode", lambda: _decode_status(responses)))
+    if capture is not None:
+        captured = [
+            record.data for record in read_capture(capture) if record.direction == RECV
+        ]
+        cases.append(
+            ("capture_decode", lambda: _decode_capture(captured, token)),
+        )
+    return cases
+
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    """Return the best throughput of `func` in calls per second."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return number / min(timer.repeat(repeat=repeat, number=number))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--save", action="store_true", help="record a new baseline")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.3,
+        help="allowed throughput loss as a fraction of the baseline",
+    )
+    parser.add_argument("--repeat", type=int, default=7, help="timing repetitions")
+    parser.add_argument("-k", dest="filter", help="only run benchmarks containing this")
+    parser.add_argument("--capture", help="capture file to decode the responses of")
+    parser.add_argument("--token", default=TOKEN.hex(), help="token of the capture")
+    args = parser.parse_args()
+
+    baseline = {}
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    except FileNotFoundError:
+        if not args.save:
+            print("No baseline at %s, run with --save first" % args.baseline)
+
+    results = {}
+    regressions = []
+    for name, func in benchmarks(args.capture, bytes.fromhex(args.token)):
+        if args.filter and args.filter not in name:
+            continue
+        ops = results[name] = measure(func, args.repeat)
+        line = "%-22s %12.0f ops/s" % (name, ops)
+        if name in baseline and not args.save:
+            change = ops / baseline[name] - 1
+            line += " %+7.1f%%" % (change * 100)
+            if change < -args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+
+    if args.save:
+        # benchmarks filtered out keep their previous result
+        results = {**baseline, **results}
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": {name: round(ops) for name, ops in results.items()},
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write("\n")
+        print("Baseline written to %s" % args.baseline)
+        return 0
+
+    if regressions:
+        print(
+            "%s regressed by more than %.0f%%: %s"
+            % (len(regressions), args.threshold * 100, ", ".join(regressions))
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
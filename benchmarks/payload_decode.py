@@ -0,0 +1,105 @@
+"""Compare decode throughput of miIO payloads for the available JSON backends.
+
+The payload is a realistic ``get_properties`` response of a Dreame vacuum, run
+with ``python benchmarks/payload_decode.py`` from the repository root.
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(__file__), "..", "custom_components", "xiaomi_vacuum"),
+)
+
+from miio.dreamevacuum import DreameVacuum  # noqa: E402
+from miio.protocol import EncryptionAdapter, Utils  # noqa: E402
+
+TOKEN = bytes.fromhex("00112233445566778899aabbccddeeff")
+NUMBER = 20000
+
+
+def _properties():
+    return [(k, v) for k, v in DreameVacuum.mapping.items() if "piid" in v]
+
+
+def _response() -> bytes:
+    """Return the encrypted response to a get_properties request of 15 properties."""
+    result = [
+        {
+            "did": name,
+            "siid": prop["siid"],
+            "piid": prop["piid"],
+            "code": 0,
+            "value": i if i % 3 else "%s-value" % name,
+        }
+        for i, (name, prop) in enumerate(_properties()[:15])
+    ]
+    payload = {"id": 4242, "result": result, "exe_time": 110}
+    return Utils.encrypt(json.dumps(payload).encode("utf-8") + b"\x00", TOKEN)
+
+
+def _legacy_decode(obj: bytes, token: bytes):
+    """Decode a payload the way it was done before the single pass decoder."""
+    decrypted = Utils.decrypt(obj, token).rstrip(b"\x00")
+    quirks = [
+        lambda b: b,
+        lambda b: b.replace(b',,"otu_stat"', b',"otu_stat"'),
+        lambda b: b[: b.rfind(b"\x00")] if b"\x00" in b else b,
+    ]
+    for i, quirk in enumerate(quirks):
+        decoded = quirk(decrypted).decode("utf-8")
+        try:
+            return json.loads(decoded)
+        except Exception:
+            if i == len(quirks) - 1:
+                raise
+
+
+def _backends():
+    """Yield the JSON backends with a loads accepting the memoryview returned by
+    ``fix_payload``, like ``protocol.json_loads`` does for each of them."""
+    yield "json", lambda data: json.loads(bytes(data))
+    try:
+        import ujson
+
+        yield "ujson", lambda data: ujson.loads(bytes(data))
+    except ImportError:
+        pass
+    try:
+        import orjson
+
+        yield "orjson", orjson.loads
+    except ImportError:
+        pass
+
+
+def main():
+    data = _response()
+    decrypted = Utils.decrypt(data, TOKEN)
+
+    def report(name, func, arg):
+        seconds = timeit.timeit(lambda: func(arg), number=NUMBER)
+        print(
+            "%-28s %8.2f us/op %10.0f ops/s"
+            % (name, seconds / NUMBER * 1e6, NUMBER / seconds)
+        )
+
+    print("payload: %s bytes encrypted, %s iterations" % (len(data), NUMBER))
+    report("decrypt+decode (legacy)", lambda d: _legacy_decode(d, TOKEN), data)
+    report(
+        "decrypt+decode (current)",
+        lambda d: EncryptionAdapter.decode_payload(d, TOKEN),
+        data,
+    )
+    for name, loads in _backends():
+        report(
+            "decode only (%s)" % name,
+            lambda d: loads(EncryptionAdapter.fix_payload(d)),
+            decrypted,
+        )
+
+
+if __name__ == "__main__":
+    main()
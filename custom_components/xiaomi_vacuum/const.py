@@ -29,6 +29,7 @@ from homeassistant.components.vacuum import (
 
 DEFAULT_NAME: Final = "Xiaomi Vacuum cleaner"
 DATA_KEY: Final = "vacuum.xiaomi_vacuum"
+MAX_PROPERTIES_CACHE: Final = "xiaomi_vacuum.max_properties.json"
 
 CONF_NO_SLEEP_DOCKED: Final = "no_sleep_when_docked"
 
@@ -64,6 +65,7 @@ ATTR_TIMEZONE: Final = "timezone"
 ATTR_CLEAN_CLOTH_TIP: Final = "clean_cloth_tip"
 ATTR_SERIAL_NUMBER: Final = "serial_number"
 ATTR_CARPET_BOOST: Final = "carpet_boost"
+ATTR_PROTOCOL_STATS: Final = "protocol_stats"
 
 SERVICE_FAST_MAP: Final = "vacuum_fast_map"
 SERVICE_SPOT_CLEAN: Final = "vacuum_spot_clean"
@@ -1,5 +1,10 @@
 from .device import Device
+from .discovery import DiscoveredDevice, discover_devices
 from .dreamevacuum import DreameVacuum
 from .exceptions import DeviceError, DeviceException
+from .gateway import MiIOGateway
+from .metrics import Histogram, ProtocolMetrics
 
-from .protocol import Message, Utils
+from .protocol import FastMessage, Message, Utils
+from .ratelimit import RateLimiter
+from .trace import PacketRecord, PacketTracer
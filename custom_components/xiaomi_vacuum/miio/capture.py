@@ -0,0 +1,266 @@
+"""Capture of miIO traffic and its deterministic replay.
+
+:class:`PacketCapture` writes every datagram sent to and received from a device
+with its timestamp to a compact binary file. :class:`ReplayTransport` feeds such a
+capture back to :class:`MiIOProtocol` and :class:`AsyncMiIOProtocol` in place of
+the network, so that latency spikes and malformed payloads seen in production can
+be reproduced offline.
+
+The file starts with :data:`MAGIC`, followed by one record per datagram: a
+:data:`RECORD` header with the timestamp, the direction, how many times the
+datagram was sent and its length, then the datagram itself.
+"""
+import asyncio
+import collections
+import queue
+import socket
+import struct
+import threading
+import time
+from typing import IO, Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from .exceptions import DeviceException
+from .protocol import HELLO_LENGTH, FastMessage
+
+MAGIC = b"MIIOCAP\x01"
+RECORD = struct.Struct(">dBBH")
+
+SEND = 0
+RECV = 1
+
+
+class CaptureRecord(NamedTuple):
+    """A captured datagram."""
+
+    ts: float
+    direction: int
+    count: int
+    data: bytes
+
+    @property
+    def hello(self) -> bool:
+        return len(self.data) == HELLO_LENGTH
+
+
+class PacketCapture:
+    """Write the datagrams exchanged with a device to a capture file.
+
+    Datagrams are recorded from the event loop and from protocol threads, so
+    they are queued and written and flushed by a thread of the capture, which is
+    stopped by :func:`close` once all queued records are written.
+    """
+
+    def __init__(self, file: Union[str, IO[bytes]]) -> None:
+        """
+        :param file: Path of the capture file or a binary file object to write to
+        """
+        if isinstance(file, str):
+            self._file = open(file, "wb")  # noqa: SIM115
+            self._owned = True
+        else:
+            self._file = file
+            self._owned = False
+        self._file.write(MAGIC)
+        # records to write, None to stop the writer
+        self._queue: "queue.SimpleQueue[Optional[bytes]]" = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = threading.Thread(
+            target=self._write, name="miio-capture", daemon=True
+        )
+        self._writer.start()
+
+    def __enter__(self) -> "PacketCapture":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def record(self, direction: int, data: bytes, count: int = 1) -> None:
+        """Write a datagram, sent `count` times in a row, to the capture.
+
+        :param direction: :data:`SEND` or :data:`RECV`
+        :param data: The datagram, any bytes-like object
+        """
+        header = RECORD.pack(time.time(), direction, count, len(data))
+        # the data may be a view into a receive buffer which is reused
+        self._queue.put(b"".join((header, data)))
+
+    def _write(self) -> None:
+        running = True
+        while running:
+            records = [self._queue.get()]
+            while not self._queue.empty():
+                records.append(self._queue.get())
+            if None in records:
+                records = records[: records.index(None)]
+                running = False
+            self._file.write(b"".join(records))
+            # captures are meant to survive a crash of the process
+            self._file.flush()
+
+    def close(self) -> None:
+        """Write the queued records and close the capture file if it was opened
+        by the capture."""
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+        if self._owned:
+            self._file.close()
+        else:
+            self._file.flush()
+
+
+def read_capture(file: Union[str, IO[bytes]]) -> Iterator[CaptureRecord]:
+    """Yield the records of a capture file.
+
+    :raises ValueError: if the file is not a capture
+    """
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            yield from read_capture(f)
+        return
+
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a miIO capture file")
+    while True:
+        header = file.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return
+        ts, direction, count, length = RECORD.unpack(header)
+        yield CaptureRecord(ts, direction, count, file.read(length))
+
+
+class _Exchange(NamedTuple):
+    """A captured request with its response, None if it went unanswered."""
+
+    request: CaptureRecord
+    response: Optional[CaptureRecord]
+
+    @property
+    def latency(self) -> Optional[float]:
+        if self.response is None:
+            return None
+        return self.response.ts - self.request.ts
+
+
+class ReplayTransport:
+    """Answer requests with the responses of a capture instead of the network.
+
+    Requests in the capture are paired with their responses, data packets by the
+    message id and handshakes with the next handshake response. Every request
+    sent through the transport is answered with the response of the next captured
+    request of the same kind, regardless of its content, and requests which went
+    unanswered in the capture time out. Set the transport as the `replay`
+    attribute of a protocol to use it.
+
+    By default responses are returned immediately, with `realtime` the captured
+    latencies and timeouts are waited for.
+    """
+
+    def __init__(
+        self,
+        file: Union[str, IO[bytes]],
+        token: bytes,
+        *,
+        addr: Tuple[str, int] = ("127.0.0.1", 54321),
+        realtime: bool = False,
+    ) -> None:
+        """
+        :param file: Path of the capture file or a binary file object to read from
+        :param token: Token of the captured device, to read the message ids
+        :param addr: Address reported as the source of the responses
+        :param realtime: Wait for the captured latencies and timeouts
+        """
+        self.token = token
+        self.addr = addr
+        self.realtime = realtime
+        self._hellos: Deque[_Exchange] = collections.deque()
+        self._requests: Deque[_Exchange] = collections.deque()
+        self._pair(read_capture(file))
+
+    def _pair(self, records: Iterator[CaptureRecord]) -> None:
+        # indexes into exchanges of the requests waiting for their response
+        hello: Optional[int] = None
+        pending: Dict[Optional[int], int] = {}
+        exchanges: List[_Exchange] = []
+
+        for record in records:
+            if record.hello:
+                if record.direction == SEND:
+                    hello = len(exchanges)
+                    exchanges.append(_Exchange(record, None))
+                elif hello is not None:
+                    exchanges[hello] = exchanges[hello]._replace(response=record)
+                    hello = None
+                continue
+
+            try:
+                msg_id = FastMessage.parse(record.data, self.token).data.value["id"]
+            except Exception:
+                if record.direction == SEND:
+                    raise
+                # unreadable responses are answers to the oldest open request
+                msg_id = next(iter(pending), None)
+            if record.direction == SEND:
+                pending[msg_id] = len(exchanges)
+                exchanges.append(_Exchange(record, None))
+            elif msg_id in pending:
+                index = pending.pop(msg_id)
+                exchanges[index] = exchanges[index]._replace(response=record)
+
+        for exchange in exchanges:
+            queue = self._hellos if exchange.request.hello else self._requests
+            queue.append(exchange)
+
+    def _next(self, hello: bool) -> _Exchange:
+        queue = self._hellos if hello else self._requests
+        if not queue:
+            raise DeviceException("End of the capture reached")
+        return queue.popleft()
+
+    def exchange(
+        self, data: bytes, count: int = 1, hello: bool = False, timeout: float = None
+    ) -> Tuple[bytes, Tuple[str, int]]:
+        """Return the next captured response, like :func:`MiIOProtocol._exchange`.
+
+        :raises socket.timeout: if the captured request went unanswered
+        """
+        exchange = self._next(hello)
+        if self._timed_out(exchange, timeout):
+            if self.realtime and timeout:
+                time.sleep(timeout)
+            raise socket.timeout("Request unanswered in the capture")
+        if self.realtime:
+            time.sleep(exchange.latency)
+        return exchange.response.data, self.addr
+
+    def _timed_out(self, exchange: _Exchange, timeout: Optional[float]) -> bool:
+        """Return if the request goes unanswered, in realtime also if the response
+        takes longer than the timeout."""
+        if exchange.response is None:
+            return True
+        return self.realtime and timeout is not None and exchange.latency > timeout
+
+    # the methods below mirror the datagram endpoint of AsyncMiIOProtocol
+
+    def sendto(self, data: bytes, count: int = 1) -> None:
+        """Ignore the request, it is answered by :func:`recv_hello` or :func:`request`."""
+
+    async def recv_hello(self, timeout: float):
+        """Return the next captured handshake response."""
+        return await self._async_response(self._next(True), timeout)
+
+    async def request(self, msg_ids: List[int], data: bytes, timeout: float):
+        """Return the next captured response, parsed with the token."""
+        data, addr = await self._async_response(self._next(False), timeout)
+        return FastMessage.parse(data, token=self.token), addr
+
+    async def _async_response(self, exchange: _Exchange, timeout: float):
+        if self._timed_out(exchange, timeout):
+            if self.realtime:
+                await asyncio.sleep(timeout)
+            raise asyncio.TimeoutError
+        if self.realtime:
+            await asyncio.sleep(exchange.latency)
+        return exchange.response.data, self.addr
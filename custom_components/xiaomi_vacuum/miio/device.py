@@ -1,14 +1,27 @@
+import asyncio
 import inspect
 import logging
 from enum import Enum
 from pprint import pformat as pf
-from typing import Any, Optional  # noqa: F401
+from typing import Any, Dict, List, Optional  # noqa: F401
 
 import click
 
+from .capture import PacketCapture, ReplayTransport
 from .click_common import DeviceGroupMeta, LiteralParamType, command, format_output
-from .exceptions import DeviceInfoUnavailableException, PayloadDecodeException
-from .miioprotocol import MiIOProtocol
+from .exceptions import (
+    DeviceException,
+    DeviceInfoUnavailableException,
+    PartialResultError,
+    PayloadDecodeException,
+)
+from .gateway import MiIOGateway
+from .metrics import ProtocolMetrics
+from .ratelimit import RateLimiter
+from .miioprotocol import AsyncMiIOProtocol, MiIOProtocol
+from .retry import RetryPolicy, RetryState
+from .sequence import IdAllocator
+from .trace import PacketTracer
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -134,7 +147,16 @@ class Device(metaclass=DeviceGroupMeta):
     """
 
     retry_count = 3
+    retry_policy: Optional[RetryPolicy] = None
     timeout = 5
+    # requests of the asyncio protocol sent without waiting for the previous
+    # responses, unless given to the constructor
+    max_in_flight = 1
+    handshake_ttl = 600
+    min_timeout: Optional[float] = 0.3
+    # requests per second and burst of the rate limiter, None to not limit
+    rate_limit: Optional[float] = None
+    rate_burst = 10
 
     def __init__(
         self,
@@ -144,12 +166,51 @@ class Device(metaclass=DeviceGroupMeta):
         debug: int = 0,
         lazy_discover: bool = True,
         timeout: int = None,
+        *,
+        max_in_flight: int = None,
     ) -> None:
         self.ip = ip
         self.token = token
         timeout = timeout if timeout is not None else self.timeout
+        if max_in_flight is not None:
+            self.max_in_flight = max_in_flight
+        # shared by both protocols, set tracer.enabled or enable debug logging
+        # to trace at runtime
+        self.tracer = PacketTracer(debug > 0)
+        self.metrics = ProtocolMetrics()
+        self.rate_limiter = RateLimiter(self.rate_limit, self.rate_burst)
+        # one sequence of message ids for both protocols, so they never collide
+        ids = IdAllocator(start_id)
         self._protocol = MiIOProtocol(
-            ip, token, start_id, debug, lazy_discover, timeout
+            ip,
+            token,
+            start_id,
+            debug,
+            lazy_discover,
+            timeout,
+            handshake_ttl=self.handshake_ttl,
+            min_timeout=self.min_timeout,
+            retry_policy=self.retry_policy,
+            tracer=self.tracer,
+            metrics=self.metrics,
+            rate_limiter=self.rate_limiter,
+            ids=ids,
+        )
+        self._async_protocol = AsyncMiIOProtocol(
+            ip,
+            token,
+            start_id,
+            debug,
+            lazy_discover,
+            timeout,
+            max_in_flight=self.max_in_flight,
+            handshake_ttl=self.handshake_ttl,
+            min_timeout=self.min_timeout,
+            retry_policy=self.retry_policy,
+            tracer=self.tracer,
+            metrics=self.metrics,
+            rate_limiter=self.rate_limiter,
+            ids=ids,
         )
 
     def send(
@@ -159,6 +220,8 @@ class Device(metaclass=DeviceGroupMeta):
         retry_count: int = None,
         *,
         extra_parameters=None,
+        deadline: float = None,
+        retry: RetryState = None,
     ) -> Any:
         """Send a command to the device.
 
@@ -173,16 +236,121 @@ class Device(metaclass=DeviceGroupMeta):
         :param dict parameters: Parameters to send
         :param int retry_count: How many times to retry on error
         :param dict extra_parameters: Extra top-level parameters
+        :param float deadline: Seconds the command including retries may take
+        :param retry: State to make the attempts under, to read the number of
+            attempts of the call from, see :func:`RetryPolicy.start`
         """
         retry_count = retry_count if retry_count is not None else self.retry_count
         return self._protocol.send(
-            command, parameters, retry_count, extra_parameters=extra_parameters
+            command,
+            parameters,
+            retry_count,
+            extra_parameters=extra_parameters,
+            deadline=deadline,
+            retry=retry,
         )
 
     def send_handshake(self):
         """Send initial handshake to the device."""
         return self._protocol.send_handshake()
 
+    async def async_send(
+        self,
+        command: str,
+        parameters: Any = None,
+        retry_count: int = None,
+        *,
+        extra_parameters=None,
+        deadline: float = None,
+        retry: RetryState = None,
+    ) -> Any:
+        """Send a command to the device without blocking the event loop.
+
+        See :func:`send` for the parameters.
+        """
+        retry_count = retry_count if retry_count is not None else self.retry_count
+        return await self._async_protocol.send(
+            command,
+            parameters,
+            retry_count,
+            extra_parameters=extra_parameters,
+            deadline=deadline,
+            retry=retry,
+        )
+
+    async def async_send_handshake(self):
+        """Send initial handshake to the device without blocking the event loop."""
+        return await self._async_protocol.send_handshake()
+
+    async def async_start_keepalive(self):
+        """Renew the handshake in the background, see :func:`close` to stop it."""
+        self._async_protocol.start_keepalive()
+
+    def close(self):
+        """Close the sockets used to communicate with the device, stop the
+        keepalive and the capture."""
+        self._protocol.close()
+        self._async_protocol.close()
+        self.stop_capture()
+
+    def start_capture(self, path: str) -> None:
+        """Record all datagrams exchanged with the device to a capture file.
+
+        See :mod:`miio.capture` for the format, :func:`replay` to play it back.
+        """
+        self.stop_capture()
+        capture = PacketCapture(path)
+        self._protocol.capture = capture
+        self._async_protocol.capture = capture
+
+    def stop_capture(self) -> None:
+        """Stop recording and close the capture file."""
+        capture = self._protocol.capture
+        self._protocol.capture = None
+        self._async_protocol.capture = None
+        if capture is not None:
+            capture.close()
+
+    def replay(self, path: Optional[str], *, realtime: bool = False) -> None:
+        """Answer all requests from a capture file instead of the network.
+
+        :param path: Capture file to replay, None to use the network again
+        :param realtime: Wait for the captured latencies and timeouts
+        """
+        replay = None
+        if path is not None:
+            replay = ReplayTransport(
+                path,
+                self._protocol.token,
+                addr=(self.ip, self._protocol.port),
+                realtime=realtime,
+            )
+        self._protocol.replay = replay
+        self._async_protocol.replay = replay
+
+    def use_gateway(self, gateway: Optional[MiIOGateway]) -> None:
+        """Send the blocking requests through the socket of a shared gateway.
+
+        :param gateway: Gateway to register with, None to use an own socket again
+        """
+        current = self._protocol.gateway
+        if current is not None:
+            current.unregister(self._protocol)
+        if gateway is not None:
+            self._protocol.close()
+            gateway.register(self._protocol)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the protocol metrics of the device.
+
+        These are the request, retry, timeout, handshake and error counters, the
+        bytes and packets sent and received, the round-trip times per method and
+        the state of the rate limiter.
+        """
+        stats = self.metrics.as_dict()
+        stats["rate_limit"] = self.rate_limiter.as_dict()
+        return stats
+
     @command(
         click.argument("command", type=str, required=True),
         click.argument("parameters", type=LiteralParamType(), required=False),
@@ -257,21 +425,86 @@ class Device(metaclass=DeviceGroupMeta):
         This is necessary as some devices have limitation on how many
         properties can be queried at once.
 
-        If `max_properties` is None, all properties are requested at once.
+        If `max_properties` is None, all properties are requested at once. A
+        failed slice does not stop the remaining ones from being requested.
 
         :param list properties: List of properties to query from the device.
         :param int max_properties: Number of properties that can be requested at once.
         :return List of property values.
+        :raises PartialResultError: if only some of the slices failed
         """
-        _props = properties.copy()
+        slices = self._slice_properties(properties, max_properties)
+        results = []
+        for props in slices:
+            try:
+                results.append(self.send(property_getter, props))
+            except DeviceException as ex:
+                results.append(ex)
+
+        return self._join_slices(properties, slices, results)
+
+    async def async_get_properties(
+        self, properties, *, property_getter="get_prop", max_properties=None
+    ):
+        """Request properties in slices, see :func:`get_properties`.
+
+        The slices are sent concurrently, as many at once as the protocol allows
+        in flight, and their values are joined in order.
+        """
+        slices = self._slice_properties(properties, max_properties)
+        results = await asyncio.gather(
+            *(self.async_send(property_getter, props) for props in slices),
+            return_exceptions=True,
+        )
+        # anything but a device error, like a cancellation, stops the request
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(
+                result, DeviceException
+            ):
+                raise result
+
+        return self._join_slices(properties, slices, results)
+
+    @staticmethod
+    def _slice_properties(properties, max_properties) -> List[list]:
+        if not properties:
+            return []
+        if max_properties is None:
+            return [list(properties)]
+        return [
+            properties[i : i + max_properties]
+            for i in range(0, len(properties), max_properties)
+        ]
+
+    @classmethod
+    def _join_slices(cls, properties, slices, results) -> list:
+        """Return the values of all slices in order.
+
+        :raises DeviceException: the error of the first slice if all of them failed
+        :raises PartialResultError: if only some of the slices failed
+        """
+        errors = {
+            i: result
+            for i, result in enumerate(results)
+            if isinstance(result, BaseException)
+        }
+        if errors and len(errors) == len(results):
+            raise errors[0]
+
         values = []
-        while _props:
-            values.extend(self.send(property_getter, _props[:max_properties]))
-            if max_properties is None:
-                break
+        for props, result in zip(slices, results):
+            values.extend(
+                [None] * len(props) if isinstance(result, BaseException) else result
+            )
+        if errors:
+            raise PartialResultError(values, errors)
+
+        cls._check_properties_count(properties, values)
 
-            _props[:] = _props[max_properties:]
+        return values
 
+    @staticmethod
+    def _check_properties_count(properties, values):
         properties_count = len(properties)
         values_count = len(values)
         if properties_count != values_count:
@@ -282,8 +515,6 @@ class Device(metaclass=DeviceGroupMeta):
                 values_count,
             )
 
-        return values
-
     @command(
         click.argument("properties", type=str, nargs=-1, required=True),
     )
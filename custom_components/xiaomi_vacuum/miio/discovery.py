@@ -0,0 +1,185 @@
+"""Asynchronous discovery of miIO devices.
+
+:func:`discover_devices` sends handshakes to broadcast addresses, single hosts or
+whole networks and yields every device as soon as it answers.
+"""
+import asyncio
+import binascii
+import ipaddress
+import logging
+from datetime import datetime
+from typing import (
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Union,
+)
+
+from .miioprotocol import HELLO_BYTES
+from .protocol import FastMessage
+
+_LOGGER = logging.getLogger(__name__)
+
+PORT = 54321
+# handshakes sent before handing control back to the event loop
+SEND_BATCH = 256
+
+
+class DiscoveredDevice(NamedTuple):
+    """A device which answered to a discovery handshake."""
+
+    ip: str
+    device_id: bytes
+    ts: datetime
+    token: bytes
+
+    def __repr__(self):
+        return "<DiscoveredDevice %s (ID: %s) ts: %s>" % (
+            self.ip,
+            binascii.hexlify(self.device_id).decode(),
+            self.ts,
+        )
+
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+    """Datagram endpoint putting handshake responses into a shared queue."""
+
+    def __init__(self, queue: asyncio.Queue) -> None:
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self._queue = queue
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self._queue.put_nowait((data, addr))
+
+    def error_received(self, exc) -> None:
+        # unicast scans provoke ICMP errors for hosts without a device
+        _LOGGER.debug("Error while discovering: %s", exc)
+
+
+def _expand_target(target: str) -> Iterator[str]:
+    """Yield the addresses to send handshakes to for an address or a network.
+
+    The hosts of a network are generated while sending, so that scanning a large
+    network does not hold all of its addresses in memory.
+    """
+    if "/" not in target:
+        yield target
+        return
+    network = ipaddress.ip_network(target, strict=False)
+    if network.num_addresses == 1:
+        yield str(network.network_address)
+        return
+    for host in network.hosts():
+        yield str(host)
+
+
+async def discover_devices(
+    targets: Iterable[str] = None,
+    *,
+    interfaces: Iterable[str] = None,
+    timeout: float = 5,
+    expected: int = None,
+    device_id: Union[bytes, str] = None,
+    port: int = PORT,
+) -> AsyncIterator[DiscoveredDevice]:
+    """Yield devices answering to handshakes as soon as their response arrives.
+
+    Handshakes are sent from one socket per local interface address, all targets
+    are scanned concurrently and every device is reported once.
+
+    :param targets: Broadcast or unicast addresses and networks in CIDR notation,
+        defaults to the limited broadcast address
+    :param interfaces: Local addresses to send from, defaults to any interface
+    :param timeout: Seconds to wait for responses after the handshakes were sent
+    :param expected: Stop after this many devices were found
+    :param device_id: Stop after the device with this id (bytes or hex) was found
+    :param port: Port of the devices
+    """
+    if isinstance(device_id, str):
+        device_id = bytes.fromhex(device_id)
+    targets = list(targets) if targets is not None else ["<broadcast>"]
+    interfaces = list(interfaces) if interfaces is not None else [None]
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    endpoints: List[_DiscoveryProtocol] = []
+    seen: Dict[str, DiscoveredDevice] = {}
+
+    async def _send(endpoint: _DiscoveryProtocol) -> None:
+        sent = 0
+        for target in targets:
+            for addr in _expand_target(target):
+                endpoint.transport.sendto(HELLO_BYTES, (addr, port))
+                sent += 1
+                if sent % SEND_BATCH == 0:
+                    await asyncio.sleep(0)
+
+    async def _send_all() -> None:
+        try:
+            await asyncio.gather(*(_send(endpoint) for endpoint in endpoints))
+        finally:
+            # marks the end of sending, from when on the timeout applies
+            queue.put_nowait(None)
+
+    sender = None
+    try:
+        for interface in interfaces:
+            _, endpoint = await loop.create_datagram_endpoint(
+                lambda: _DiscoveryProtocol(queue),
+                local_addr=(interface or "0.0.0.0", 0),  # nosec
+                allow_broadcast=True,
+            )
+            endpoints.append(endpoint)
+
+        _LOGGER.info(
+            "Sending discovery to %s with timeout of %ss..", ", ".join(targets), timeout
+        )
+        sender = loop.create_task(_send_all())
+        end = None
+        while True:
+            remaining = None if end is None else end - loop.time()
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                sender.result()
+                end = loop.time() + timeout
+                continue
+
+            data, addr = item
+            try:
+                m = FastMessage.parse(data)
+            except Exception as ex:
+                _LOGGER.debug("Ignoring invalid response from %s: %s", addr[0], ex)
+                continue
+            if addr[0] in seen or m.header.value.length != len(HELLO_BYTES):
+                continue
+
+            header = m.header.value
+            device = DiscoveredDevice(addr[0], header.device_id, header.ts, m.checksum)
+            seen[addr[0]] = device
+            _LOGGER.debug("Discovered %s", device)
+            yield device
+
+            if device_id is not None and device.device_id == device_id:
+                break
+            if expected is not None and len(seen) >= expected:
+                break
+    finally:
+        if sender is not None:
+            sender.cancel()
+        for endpoint in endpoints:
+            if endpoint.transport is not None:
+                endpoint.transport.close()
+
+    _LOGGER.info("Discovery done, found %s devices", len(seen))
@@ -60,6 +60,35 @@ DreameD9Mapping = {
     "property_total_clean_area": {"siid": 12, "piid": 4},
 }
 
+# longest seconds between reads of the properties which change rarely
+DreameD9PollIntervals = {
+    ## Settings
+    "property_carpet_boost": 300,
+    "property_remote_control_step": 300,
+    "property_dnd_enabled": 300,
+    "property_dnd_start_time": 300,
+    "property_dnd_stop_time": 300,
+    "property_multi_map_enabled": 300,
+    "property_audio_volume": 300,
+    "property_audio_language": 300,
+    "property_voice": 300,
+    "property_timezone": 300,
+    "property_scheduled-clean": 300,
+    ## Consumables and totals, which change while cleaning only
+    "property_main_brush_left_time": 3600,
+    "property_main_brush_life_level": 3600,
+    "property_side_brush_left_time": 3600,
+    "property_side_brush_life_level": 3600,
+    "property_filter_life_level": 3600,
+    "property_filter_left_time": 3600,
+    "property_first-clean-time": 3600,
+    "property_total_clean_time": 3600,
+    "property_total_clean_count": 3600,
+    "property_total_clean_area": 3600,
+    ## Constant
+    "property_serial_number": 86400,
+}
+
 
 class ChargeStatus(IntEnum):
     Unknown = -1
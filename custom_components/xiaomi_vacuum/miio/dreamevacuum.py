@@ -1,5 +1,6 @@
 import logging
 from dataclasses import dataclass, field
+from typing import Optional
 
 import click
 from .click_common import command
@@ -192,19 +193,37 @@ class DreameVacuumStatus(DeviceStatusContainer):
 
 
 class DreameVacuum(MiotDevice):
-    """Support for dreame vacuum robot d9 (dreame.vacuum.p2009)."""
+    """Support for dreame vacuum robot d9 (dreame.vacuum.p2009).
+
+    Every command has an ``async_`` counterpart sending the same requests without
+    blocking the event loop, used by the Home Assistant entity.
+    """
 
     mapping = DreameD9Mapping
+    poll_intervals = DreameD9PollIntervals
+    # the firmware handles a status poll worth of requests at once
+    max_in_flight = 3
+    # the firmware drops requests when flooded, see RateLimiter
+    rate_limit = 5.0
 
     def status(self) -> DreameVacuumStatus:
         """State of the vacuum."""
 
-        return DreameVacuumStatus(
-            {
-                prop["did"]: (prop["value"] if "value" in prop.keys() else None) if prop["code"] == 0 else None
-                for prop in self.get_properties_for_mapping()
-            }
-        )
+        return self._create_status(self.get_properties_for_mapping())
+
+    async def async_status(self) -> DreameVacuumStatus:
+        return self._create_status(await self.async_get_properties_for_mapping())
+
+    def cached_status(self) -> Optional[DreameVacuumStatus]:
+        """State of the vacuum as of the last poll and the settings changed since,
+        None before the first poll."""
+        properties = self.cached_properties()
+        if not properties:
+            return None
+        return self._create_status(properties)
+
+    def _create_status(self, properties) -> DreameVacuumStatus:
+        return DreameVacuumStatus(self._compiled.decode(properties))
 
     @command(click.argument("speed", type=int))
     def set_fan_speed(self, speed):
@@ -279,14 +298,19 @@ class DreameVacuum(MiotDevice):
     @command()
     def rename_map(self, map_id, map_name) -> None:
         """Rename a map"""
-        payload = [
+        return self.call_action(
+            "action_set_map", self._rename_map_payload(map_id, map_name)
+        )
+
+    @staticmethod
+    def _rename_map_payload(map_id, map_name):
+        return [
             {
                 "piid": 4,
                 "value": '{"nrism":{%(id)s:{"name":%(name)s} } }'
                 % {"id": map_id, "name": map_name},
             },
         ]
-        return self.call_action("action_set_map", payload)
 
     @command()
     def set_dnd(self, dnd_enabled) -> None:
@@ -303,10 +327,32 @@ class DreameVacuum(MiotDevice):
         """set end time for do not disturb function."""
         return self.set_property("property_dnd_stop_time", dnd_stop)
 
+    @command(
+        click.option("--enabled", type=bool, default=None),
+        click.option("--start", type=str, default=None),
+        click.option("--stop", type=str, default=None),
+    )
+    def set_dnd_settings(self, enabled=None, start=None, stop=None) -> dict:
+        """Set the given do not disturb settings in one request."""
+        return self.set_properties(self._dnd_settings_values(enabled, start, stop))
+
+    @staticmethod
+    def _dnd_settings_values(enabled, start, stop) -> dict:
+        values = {
+            "property_dnd_enabled": enabled,
+            "property_dnd_start_time": start,
+            "property_dnd_stop_time": stop,
+        }
+        return {key: value for key, value in values.items() if value is not None}
+
     @command(click.argument("coords", type=str), click.argument("repeats", type=int))
     def zone_cleanup(self, coords, repeats) -> None:
         """Start zone cleaning."""
-        payload = [
+        return self.start_sweeping_advanced(self._zone_cleanup_payload(coords, repeats))
+
+    @staticmethod
+    def _zone_cleanup_payload(coords, repeats):
+        return [
             {"piid": 1, "value": 19},
             {
                 "piid": 10,
@@ -315,11 +361,16 @@ class DreameVacuum(MiotDevice):
                 # TODO find out why the two last parameters do not affect fan speed or water level / what do they do?
             },
         ]
-        return self.start_sweeping_advanced(payload)
 
     @command()
     def room_cleanup_by_id(self, rooms, repeats, clean_mode, mop_mode) -> None:
         """Start room-id cleaning."""
+        return self.start_sweeping_advanced(
+            self._room_cleanup_payload(rooms, repeats, clean_mode, mop_mode)
+        )
+
+    @staticmethod
+    def _room_cleanup_payload(rooms, repeats, clean_mode, mop_mode):
         cleanlist = []
         for sublist in rooms:
             if len(sublist) > 1:
@@ -337,14 +388,13 @@ class DreameVacuum(MiotDevice):
                     rooms.index(sublist) + 1,
                 ]
             )
-        payload = [
+        return [
             {"piid": 1, "value": 18},
             {
                 "piid": 10,
                 "value": '{"selects": ' + str(cleanlist).replace(" ", "") + "}",
             },
         ]
-        return self.start_sweeping_advanced(payload)
 
     @command(
         click.argument("walls", type=str),
@@ -353,13 +403,16 @@ class DreameVacuum(MiotDevice):
     )
     def set_restricted_zone(self, walls, zones, mops) -> None:
         """set restricted/ no-mop zone"""
+        return self.set_map(self._restricted_zone_payload(walls, zones, mops))
+
+    @staticmethod
+    def _restricted_zone_payload(walls, zones, mops):
         value = '{"vw":{"line":[%(walls)s],"rect":[%(zones)s],"mop":[%(mops)s]}}' % {
             "walls": walls,
             "zones": zones,
             "mops": mops,
         }
-        payload = [{"piid": 4, "value": value}]
-        return self.set_map(payload)
+        return [{"piid": 4, "value": value}]
 
     @command()
     def remote_control_step(self, rotation, velocity) -> None:
@@ -368,11 +421,17 @@ class DreameVacuum(MiotDevice):
         :param int rotation: angle to rotate in binary angles 128 to -128
         :param int velocity: speed to move forward or backward 100 to -300
         """
-        value = '{"spdv":%(velocity)d,"spdw":%(rotation)d,"audio":"false"}' % {
+        return self.set_property(
+            "property_remote_control_step",
+            self._remote_control_step_value(rotation, velocity),
+        )
+
+    @staticmethod
+    def _remote_control_step_value(rotation, velocity):
+        return '{"spdv":%(velocity)d,"spdw":%(rotation)d,"audio":"false"}' % {
             "velocity": velocity,
             "rotation": rotation,
         }
-        return self.set_property("property_remote_control_step", value)
 
     @command()
     def request_map(self, params) -> None:
@@ -382,13 +441,16 @@ class DreameVacuum(MiotDevice):
     @command()
     def select_map(self, map_id) -> None:
         """Switch to another map."""
-        payload = [
+        return self.set_map(self._select_map_payload(map_id))
+
+    @staticmethod
+    def _select_map_payload(map_id):
+        return [
             {
                 "piid": 4,
                 "value": '{"sm": ' + "{" + "}" + ', "mapid":' + str(map_id) + "}",
             }
         ]
-        return self.set_map(payload)
 
     @command(click.argument("water", type=int))
     def set_water_level(self, water):
@@ -403,11 +465,16 @@ class DreameVacuum(MiotDevice):
     @command()
     def install_voice_pack(self, lang_id: str, url: str, md5: str, size: int) -> None:
         """Install given voice pack."""
-        value = (
+        self.set_property(
+            "property_voice", self._voice_pack_value(lang_id, url, md5, size)
+        )
+
+    @staticmethod
+    def _voice_pack_value(lang_id, url, md5, size):
+        return (
             '{"id":"%(lang_id)s","url":"%(url)s","md5":"%(md5)s","size":%(size)d}'
             % {"lang_id": lang_id, "url": url, "md5": md5, "size": size}
         )
-        self.set_property("property_voice", value)
 
     @command(click.argument("volume", type=int))
     def set_audio_volume(self, volume):
@@ -423,3 +490,116 @@ class DreameVacuum(MiotDevice):
     def set_cloth_cleaning_tip(self, delay):
         """Set reminder delay for cleaning mop, 0 to disable the tip"""
         return self.set_property("property_clean_cloth_tip", delay)
+
+    # Asyncio counterparts of the commands above
+
+    async def async_set_fan_speed(self, speed):
+        return await self.async_set_property("property_cleaning_mode", speed)
+
+    async def async_return_home(self) -> None:
+        return await self.async_call_action("action_start_charging")
+
+    async def async_start_sweep(self) -> None:
+        return await self.async_call_action("action_start_sweeping")
+
+    async def async_pause_sweeping(self) -> None:
+        return await self.async_call_action("action_pause_sweeping")
+
+    async def async_reset_brush_life(self) -> None:
+        return await self.async_call_action("action_reset_main_brush_life")
+
+    async def async_reset_filter_life(self) -> None:
+        return await self.async_call_action("action_reset_filter_life")
+
+    async def async_reset_side_brush_life(self) -> None:
+        return await self.async_call_action("action_reset_side_brush_life")
+
+    async def async_start_sweeping_advanced(self, params) -> None:
+        return await self.async_call_action("action_start_sweeping_advanced", params)
+
+    async def async_stop_sweeping(self) -> None:
+        return await self.async_call_action("action_stop_sweeping")
+
+    async def async_set_map(self, params) -> None:
+        return await self.async_call_action("action_set_map", params)
+
+    async def async_fast_map(self) -> None:
+        payload = [{"piid": 1, "value": 21}]
+        return await self.async_start_sweeping_advanced(payload)
+
+    async def async_set_carpet_boost(self, carpet_boost_enabled) -> None:
+        return await self.async_set_property(
+            "property_carpet_boost", 1 if carpet_boost_enabled else 0
+        )
+
+    async def async_set_multi_map(self, multi_map_enabled) -> None:
+        return await self.async_set_property(
+            "property_multi_map_enabled", 1 if multi_map_enabled else 0
+        )
+
+    async def async_rename_map(self, map_id, map_name) -> None:
+        return await self.async_call_action(
+            "action_set_map", self._rename_map_payload(map_id, map_name)
+        )
+
+    async def async_set_dnd(self, dnd_enabled) -> None:
+        return await self.async_set_property("property_dnd_enabled", dnd_enabled)
+
+    async def async_set_dnd_start(self, dnd_start) -> None:
+        return await self.async_set_property("property_dnd_start_time", dnd_start)
+
+    async def async_set_dnd_stop(self, dnd_stop) -> None:
+        return await self.async_set_property("property_dnd_stop_time", dnd_stop)
+
+    async def async_set_dnd_settings(self, enabled=None, start=None, stop=None) -> dict:
+        return await self.async_set_properties(
+            self._dnd_settings_values(enabled, start, stop)
+        )
+
+    async def async_zone_cleanup(self, coords, repeats) -> None:
+        return await self.async_start_sweeping_advanced(
+            self._zone_cleanup_payload(coords, repeats)
+        )
+
+    async def async_room_cleanup_by_id(
+        self, rooms, repeats, clean_mode, mop_mode
+    ) -> None:
+        return await self.async_start_sweeping_advanced(
+            self._room_cleanup_payload(rooms, repeats, clean_mode, mop_mode)
+        )
+
+    async def async_set_restricted_zone(self, walls, zones, mops) -> None:
+        return await self.async_set_map(
+            self._restricted_zone_payload(walls, zones, mops)
+        )
+
+    async def async_remote_control_step(self, rotation, velocity) -> None:
+        return await self.async_set_property(
+            "property_remote_control_step",
+            self._remote_control_step_value(rotation, velocity),
+        )
+
+    async def async_select_map(self, map_id) -> None:
+        return await self.async_set_map(self._select_map_payload(map_id))
+
+    async def async_set_water_level(self, water):
+        return await self.async_set_property("property_water_level", water)
+
+    async def async_locate(self) -> None:
+        return await self.async_call_action("action_locate")
+
+    async def async_install_voice_pack(
+        self, lang_id: str, url: str, md5: str, size: int
+    ) -> None:
+        await self.async_set_property(
+            "property_voice", self._voice_pack_value(lang_id, url, md5, size)
+        )
+
+    async def async_set_audio_volume(self, volume):
+        return await self.async_set_property("property_audio_volume", volume)
+
+    async def async_test_sound(self) -> None:
+        return await self.async_call_action("action_test_sound")
+
+    async def async_set_cloth_cleaning_tip(self, delay):
+        return await self.async_set_property("property_clean_cloth_tip", delay)
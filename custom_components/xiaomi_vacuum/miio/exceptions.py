@@ -1,5 +1,13 @@
+from typing import Optional
+
+
 class DeviceException(Exception):
-    """Exception wrapping any communication errors with the device."""
+    """Exception wrapping any communication errors with the device.
+
+    `attempts` is the number of attempts the failed call made, if known.
+    """
+
+    attempts: Optional[int] = None
 
 
 class PayloadDecodeException(DeviceException):
@@ -18,6 +26,34 @@ class DeviceInfoUnavailableException(DeviceException):
     """
 
 
+class DeadlineExceededError(DeviceException):
+    """Exception raised when the deadline of a call passed before the next attempt.
+
+    The error of the last attempt, if any, is the cause of this exception.
+    """
+
+
+class NoResponseError(DeviceException):
+    """Exception raised when the device did not answer any attempt of a call."""
+
+
+class PartialResultError(DeviceException):
+    """Exception raised when only some slices of a property request succeeded.
+
+    `values` holds the values of all requested properties in order, with None for
+    the properties of the failed slices, and `errors` maps the index of every
+    failed slice to its exception.
+    """
+
+    def __init__(self, values, errors):
+        super().__init__(
+            "%s of the property requests failed: %s"
+            % (len(errors), ", ".join(repr(ex) for ex in errors.values()))
+        )
+        self.values = values
+        self.errors = errors
+
+
 class DeviceError(DeviceException):
     """Exception communicating an error delivered by the target device.
 
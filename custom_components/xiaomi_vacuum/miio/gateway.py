@@ -0,0 +1,325 @@
+"""Shared socket for many miIO devices.
+
+:class:`MiIOGateway` owns a single UDP socket and a selector loop (epoll on
+Linux) running in one background thread. Blocking :class:`MiIOProtocol`
+instances registered with it send through that socket instead of their own, and
+the loop routes every response to the request waiting for it by the address,
+the device id and the message id. This lets one process poll a large fleet of
+devices without a socket per device.
+"""
+import concurrent.futures
+import logging
+import select
+import selectors
+import socket
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from .capture import RECV as RECV_DATAGRAM
+from .capture import SEND as SEND_DATAGRAM
+from .exceptions import DeviceException
+from .protocol import HELLO_LENGTH, FastMessage
+from .sequence import call_waiter, message_id
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .miioprotocol import MiIOProtocol
+
+_LOGGER = logging.getLogger(__name__)
+
+# offset of the device id in the packet header
+DEVICE_ID = slice(8, 12)
+# sized for bursts of responses from thousands of devices, the kernel limits
+# them to net.core.rmem_max and net.core.wmem_max
+DEFAULT_RCVBUF = 4 * 1024 * 1024
+DEFAULT_SNDBUF = 1024 * 1024
+
+Address = Tuple[str, int]
+# None for the handshake, else the device id and the message id
+_Key = Optional[Tuple[bytes, int]]
+
+
+class MiIOGateway:
+    """Send the requests of many devices through a single UDP socket.
+
+    Register a protocol with :func:`register`, or a device with
+    :func:`Device.use_gateway`, to route its handshakes and commands through the
+    gateway. Each address can be registered once. The gateway can be used as a
+    context manager to close it on exit.
+    """
+
+    def __init__(
+        self,
+        bind: Address = ("0.0.0.0", 0),
+        *,
+        rcvbuf: int = DEFAULT_RCVBUF,
+        sndbuf: int = DEFAULT_SNDBUF,
+        buffer_size: int = 4096,
+    ) -> None:
+        """
+        :param bind: Local address of the socket
+        :param rcvbuf: Wanted size of the socket receive buffer in bytes
+        :param sndbuf: Wanted size of the socket send buffer in bytes
+        :param buffer_size: Size of the buffer datagrams are received into
+        """
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+            self._socket.bind(bind)
+        except OSError:
+            self._socket.close()
+            raise
+        _LOGGER.debug(
+            "Gateway bound to %s with buffers of %s/%s bytes",
+            self._socket.getsockname(),
+            self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+            self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+        )
+        # receives never block, sends wait for room in the send buffer
+        self._socket.setblocking(False)
+
+        self._buffer = memoryview(bytearray(buffer_size))
+        self._devices: Dict[Address, "MiIOProtocol"] = {}
+        self._addresses: Dict["MiIOProtocol", Address] = {}
+        self._pending: Dict[Address, Dict[_Key, concurrent.futures.Future]] = {}
+        self._lock = threading.Lock()
+        # responses nobody waited for, and datagrams from unknown addresses
+        self.dropped = 0
+        # receive errors in a row, to back off on a persistent error
+        self._errors = 0
+
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._selector.register(self._socket, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def __enter__(self) -> "MiIOGateway":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    @property
+    def address(self) -> Address:
+        """Return the local address of the socket."""
+        return self._socket.getsockname()
+
+    def register(self, protocol: "MiIOProtocol") -> None:
+        """Route the handshakes and commands of the protocol through the gateway.
+
+        :raises DeviceException: if another protocol uses the same address
+        """
+        addr = (socket.gethostbyname(protocol.ip), protocol.port)
+        with self._lock:
+            if self._closed:
+                raise DeviceException("The gateway is closed")
+            registered = self._devices.get(addr)
+            if registered is not None and registered is not protocol:
+                raise DeviceException("%s:%s is already registered" % addr)
+            self._devices[addr] = protocol
+            self._addresses[protocol] = addr
+            self._pending.setdefault(addr, {})
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="MiIOGateway", daemon=True
+                )
+                self._thread.start()
+        protocol.gateway = self
+
+    def unregister(self, protocol: "MiIOProtocol") -> None:
+        """Let the protocol use its own socket again."""
+        with self._lock:
+            addr = self._addresses.pop(protocol, None)
+            if addr is not None:
+                del self._devices[addr]
+                self._fail(self._pending.pop(addr, {}), DeviceException("Unregistered"))
+        if protocol.gateway is self:
+            protocol.gateway = None
+
+    def close(self) -> None:
+        """Unregister all protocols and stop the loop."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            protocols = list(self._addresses)
+        for protocol in protocols:
+            self.unregister(protocol)
+        self._wakeup_w.send(b"\0")
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._selector.close()
+        self._socket.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def handshake(
+        self, protocol: "MiIOProtocol", data: bytes, count: int, timeout: float
+    ) -> Tuple[bytes, Address]:
+        """Send the handshake `count` times and return the handshake response.
+
+        :raises socket.timeout: if the device did not answer in time
+        """
+        return self._request(protocol, None, data, count, timeout)
+
+    def request(
+        self,
+        protocol: "MiIOProtocol",
+        msg_ids: List[int],
+        data: bytes,
+        timeout: float,
+    ):
+        """Send a request and return its parsed response with the address.
+
+        The responses to the attempts of the call are awaited until it is
+        released with :func:`release`, see :func:`call_waiter`.
+
+        :param msg_ids: Ids of the attempts of the call, the one of this request last
+        :raises socket.timeout: if the device did not answer in time
+        """
+        addr = self._addresses.get(protocol)
+        if addr is None:
+            raise DeviceException("%s is not registered" % protocol.ip)
+        device_id = protocol._handshake.device_id
+        keys = [(device_id, msg_id) for msg_id in msg_ids]
+        with self._lock:
+            waiter = call_waiter(self._pending[addr], keys, concurrent.futures.Future)
+        if not waiter.done():
+            self._sendto(data, addr)
+            protocol.metrics.sent(len(data))
+            if protocol.capture is not None:
+                protocol.capture.record(SEND_DATAGRAM, data)
+        try:
+            return waiter.result(timeout)
+        except concurrent.futures.TimeoutError:
+            raise socket.timeout("timed out") from None
+
+    def release(self, protocol: "MiIOProtocol", msg_ids: List[int]) -> None:
+        """Stop awaiting the responses to the attempts of a finished call."""
+        addr = self._addresses.get(protocol)
+        device_id = protocol._handshake.device_id
+        with self._lock:
+            pending = self._pending.get(addr, {})
+            for msg_id in msg_ids:
+                pending.pop((device_id, msg_id), None)
+
+    def _request(
+        self, protocol: "MiIOProtocol", key: _Key, data: bytes, count: int, timeout
+    ):
+        addr = self._addresses.get(protocol)
+        if addr is None:
+            raise DeviceException("%s is not registered" % protocol.ip)
+        waiter: concurrent.futures.Future = concurrent.futures.Future()
+        with self._lock:
+            pending = self._pending[addr]
+            if key in pending:
+                raise DeviceException("Request %s is already in flight" % (key,))
+            pending[key] = waiter
+        try:
+            for _ in range(count):
+                self._sendto(data, addr)
+            protocol.metrics.sent(len(data), count)
+            if protocol.capture is not None:
+                protocol.capture.record(SEND_DATAGRAM, data, count)
+            return waiter.result(timeout)
+        except concurrent.futures.TimeoutError:
+            raise socket.timeout("timed out") from None
+        finally:
+            with self._lock:
+                if pending.get(key) is waiter:
+                    del pending[key]
+
+    def _sendto(self, data: bytes, addr: Address) -> None:
+        while True:
+            try:
+                self._socket.sendto(data, addr)
+                return
+            except (BlockingIOError, InterruptedError):
+                # the send buffer is full
+                select.select([], [self._socket], [])
+
+    def _run(self) -> None:
+        while True:
+            for key, _ in self._selector.select():
+                if key.fileobj is self._wakeup_r:
+                    return
+                self._receive()
+
+    def _receive(self) -> None:
+        """Dispatch all datagrams waiting in the socket buffer."""
+        while True:
+            try:
+                size, addr = self._socket.recvfrom_into(self._buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as ex:
+                # ICMP errors of earlier sends, the request will time out
+                _LOGGER.debug("Error while receiving: %s", ex)
+                self._errors += 1
+                if self._errors > 1:
+                    # do not spin the loop on an error which persists
+                    time.sleep(min(0.01 * 2 ** min(self._errors, 10), 1.0))
+                return
+            self._errors = 0
+            self._dispatch(self._buffer[:size], addr)
+
+    def _dispatch(self, data: memoryview, addr: Address) -> None:
+        protocol = self._devices.get(addr)
+        if protocol is None:
+            self.dropped += 1
+            return
+        protocol.metrics.received(len(data))
+        if protocol.capture is not None:
+            protocol.capture.record(RECV_DATAGRAM, data)
+
+        hello = len(data) == HELLO_LENGTH
+        pending = self._pending.get(addr)
+        if not pending:
+            self._drop(protocol, addr, hello)
+            return
+
+        if hello:
+            key: _Key = None
+            result = bytes(data)
+        else:
+            try:
+                result = FastMessage.parse(data, token=protocol.crypto)
+            except Exception as ex:
+                self._drop_invalid(protocol, addr, ex)
+                return
+            msg_id = message_id(result)
+            if msg_id is None:
+                self._drop_invalid(protocol, addr, "no message id")
+                return
+            key = (bytes(data[DEVICE_ID]), msg_id)
+
+        with self._lock:
+            waiter = pending.get(key)
+            if waiter is not None and not waiter.done():
+                waiter.set_result((result, addr))
+                return
+        _LOGGER.debug("Dropping response from %s to unknown request %s", addr, key)
+        self._drop(protocol, addr, hello)
+
+    def _drop(self, protocol: "MiIOProtocol", addr: Address, hello: bool) -> None:
+        self.dropped += 1
+        # repeated handshake responses are expected, as the handshake is repeated
+        if not hello:
+            protocol.metrics.stale_responses += 1
+
+    def _drop_invalid(self, protocol: "MiIOProtocol", addr: Address, reason) -> None:
+        _LOGGER.debug("Dropping unreadable response from %s: %s", addr, reason)
+        self.dropped += 1
+        protocol.metrics.invalid_responses += 1
+
+    @staticmethod
+    def _fail(pending: Dict[_Key, concurrent.futures.Future], exc: Exception) -> None:
+        for waiter in pending.values():
+            if not waiter.done():
+                waiter.set_exception(exc)
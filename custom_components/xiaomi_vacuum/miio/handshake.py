@@ -0,0 +1,92 @@
+"""Handshake state of a miIO device.
+
+The handshake tells the device id and the device's clock, both of which are needed
+to build messages. :class:`HandshakeManager` keeps them together with the offset of
+the device clock against the local monotonic clock, so that message timestamps can
+be computed locally, and decides when a new handshake is due.
+"""
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class HandshakeManager:
+    """Track the handshake state and the clock offset of a device.
+
+    A handshake is needed when none was done yet, when the last one is older than
+    `ttl` seconds, or when `max_failures` requests in a row went unanswered.
+    """
+
+    def __init__(self, ttl: Optional[float] = 600, max_failures: int = 2) -> None:
+        """
+        :param ttl: Seconds after which a new handshake is done, None to never expire
+        :param max_failures: Consecutive failed requests invalidating the handshake
+        """
+        self.ttl = ttl
+        self.max_failures = max_failures
+        self.device_id = bytes()
+        self.count = 0
+
+        self._offset: Optional[float] = None
+        self._handshake_at = 0.0
+        self._failures = 0
+
+    @property
+    def valid(self) -> bool:
+        """Return True if the handshake state can be used."""
+        return self._offset is not None and self.expires_in > 0
+
+    @property
+    def expires_in(self) -> float:
+        """Return the seconds until the handshake expires."""
+        if self._offset is None:
+            return 0.0
+        if self.ttl is None:
+            return float("inf")
+        return self._handshake_at + self.ttl - time.monotonic()
+
+    @property
+    def ts(self) -> datetime:
+        """Return the current time of the device clock."""
+        if self._offset is None:
+            return datetime.utcnow()
+        return datetime.utcfromtimestamp(int(time.monotonic() + self._offset))
+
+    def update(self, device_id: bytes, ts: datetime) -> None:
+        """Store the result of a handshake."""
+        now = time.monotonic()
+        self.device_id = device_id
+        self._offset = self._timestamp(ts) - now
+        self._handshake_at = now
+        self._failures = 0
+        self.count += 1
+
+    def observe(self, ts: datetime) -> None:
+        """Adjust the clock offset from the timestamp of a response.
+
+        The device clock has a resolution of one second, so the offset is only
+        moved forward to not lose the sub-second part gathered before.
+        """
+        self._failures = 0
+        if self._offset is None:
+            return
+        self._offset = max(self._offset, self._timestamp(ts) - time.monotonic())
+
+    def failed(self) -> None:
+        """Record a request without response, invalidating the handshake if needed."""
+        self._failures += 1
+        if self._failures >= self.max_failures:
+            _LOGGER.debug("%s requests failed, handshake invalidated", self._failures)
+            self.invalidate()
+
+    def invalidate(self) -> None:
+        """Require a new handshake before the next request."""
+        self._offset = None
+        self._failures = 0
+
+    @staticmethod
+    def _timestamp(ts: datetime) -> float:
+        return (ts - datetime(1970, 1, 1)).total_seconds()
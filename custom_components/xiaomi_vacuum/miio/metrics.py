@@ -0,0 +1,225 @@
+"""Protocol metrics of miIO devices.
+
+:class:`ProtocolMetrics` counts what happens on the wire for a device: requests,
+retries, timeouts, handshakes, checksum and recoverable errors, stale responses
+to requests which were given up on, bytes and packets in both directions, and
+keeps a round-trip time :class:`Histogram` per method.
+Recording is a few integer additions per packet, so it is always enabled.
+
+:class:`RtoEstimator` smoothes the round-trip times into the retransmission
+timeout used for the next request, like TCP does (RFC 6298).
+"""
+import bisect
+from typing import Any, Dict, Optional, Tuple
+
+# upper bounds of the round-trip time buckets in seconds
+RTT_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    """Convert seconds to milliseconds rounded for display."""
+    return None if value is None else round(value * 1000, 1)
+
+
+class Histogram:
+    """Fixed bucket histogram of durations in seconds."""
+
+    def __init__(self, bounds: Tuple[float, ...] = RTT_BUCKETS) -> None:
+        """
+        :param bounds: Ascending upper bounds of the buckets, larger values are
+            counted in an extra overflow bucket
+        """
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float) -> None:
+        """Add a value to the histogram."""
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Return an upper estimate of the `q` quantile, None without values.
+
+        The estimate is the upper bound of the bucket the quantile falls into,
+        limited by the largest value seen.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        """Return the mean of all values, None without values."""
+        return self.sum / self.count if self.count else None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return a summary with the values converted to milliseconds."""
+        return {
+            "count": self.count,
+            "mean_ms": _ms(self.mean),
+            "min_ms": _ms(self.min),
+            "p50_ms": _ms(self.quantile(0.5)),
+            "p90_ms": _ms(self.quantile(0.9)),
+            "p99_ms": _ms(self.quantile(0.99)),
+            "max_ms": _ms(self.max),
+            "buckets": dict(
+                zip(
+                    ["<=%sms" % _ms(bound) for bound in self.bounds] + ["inf"],
+                    self.buckets,
+                )
+            ),
+        }
+
+
+class RtoEstimator:
+    """Retransmission timeout estimated from the smoothed round-trip time.
+
+    The timeout is the smoothed round-trip time plus four times its variation,
+    doubled after every timeout until the next round-trip time is observed.
+    """
+
+    alpha = 1 / 8
+    beta = 1 / 4
+    k = 4
+    # clock granularity, the least the variation adds to the timeout
+    granularity = 0.01
+
+    def __init__(self) -> None:
+        self.srtt: Optional[float] = None
+        self.rttvar: Optional[float] = None
+        self.backoff = 0
+        # the last timeout returned by timeout()
+        self.last: Optional[float] = None
+
+    def observe(self, rtt: float) -> None:
+        """Update the estimate with the round-trip time of an unretried request."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.beta * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.alpha * (rtt - self.srtt)
+        self.backoff = 0
+
+    def timed_out(self) -> None:
+        """Double the timeout after a request went unanswered."""
+        self.backoff += 1
+
+    def timeout(self, min_timeout: float, max_timeout: float) -> float:
+        """Return the timeout for the next request within the given bounds.
+
+        Without any round-trip time observed yet, this is `max_timeout`.
+        """
+        if self.srtt is None:
+            self.last = max_timeout
+        else:
+            rto = self.srtt + max(self.granularity, self.k * self.rttvar)
+            # the exponent is capped as the result is clamped anyway
+            rto *= 2 ** min(self.backoff, 16)
+            self.last = min(max(rto, min_timeout), max_timeout)
+        return self.last
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the estimate with the values converted to milliseconds."""
+        return {
+            "srtt_ms": _ms(self.srtt),
+            "rttvar_ms": _ms(self.rttvar),
+            "timeout_ms": _ms(self.last),
+            "backoff": self.backoff,
+        }
+
+
+class ProtocolMetrics:
+    """Counters, round-trip times and the retransmission timeout of a device."""
+
+    COUNTERS = (
+        "requests",
+        "failures",
+        "retries",
+        "timeouts",
+        "handshakes",
+        "checksum_errors",
+        "recoverable_errors",
+        "stale_responses",
+        "invalid_responses",
+        "packets_sent",
+        "packets_received",
+        "bytes_sent",
+        "bytes_received",
+    )
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        """Set all counters to zero and forget the round-trip times."""
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.handshakes = 0
+        self.checksum_errors = 0
+        self.recoverable_errors = 0
+        self.stale_responses = 0
+        # responses which could not be parsed or carry no message id
+        self.invalid_responses = 0
+        self.packets_sent = 0
+        self.packets_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.rtt: Dict[str, Histogram] = {}
+        # per method, as actions take much longer than property reads
+        self.rto: Dict[str, RtoEstimator] = {}
+
+    def sent(self, size: int, count: int = 1) -> None:
+        """Count `count` packets of `size` bytes sent to the device."""
+        self.packets_sent += count
+        self.bytes_sent += size * count
+
+    def received(self, size: int) -> None:
+        """Count a packet of `size` bytes received from the device."""
+        self.packets_received += 1
+        self.bytes_received += size
+
+    def observe_rtt(self, method: str, seconds: float) -> None:
+        """Record the round-trip time of a request of the given method."""
+        histogram = self.rtt.get(method)
+        if histogram is None:
+            histogram = self.rtt[method] = Histogram()
+        histogram.observe(seconds)
+
+    def rto_for(self, method: str) -> RtoEstimator:
+        """Return the retransmission timeout estimate of the given method."""
+        estimator = self.rto.get(method)
+        if estimator is None:
+            estimator = self.rto[method] = RtoEstimator()
+        return estimator
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return all counters, the round-trip time summaries and the
+        retransmission timeout estimates per method."""
+        stats: Dict[str, Any] = {
+            counter: getattr(self, counter) for counter in self.COUNTERS
+        }
+        stats["rtt"] = {
+            method: histogram.as_dict() for method, histogram in self.rtt.items()
+        }
+        stats["rto"] = {
+            method: estimator.as_dict() for method, estimator in self.rto.items()
+        }
+        return stats
@@ -1,25 +1,56 @@
 """miIO protocol implementation.
 
 This module contains the implementation of routines to send handshakes, send commands
-and discover devices (MiIOProtocol).
+and discover devices (MiIOProtocol), and its asyncio counterpart (AsyncMiIOProtocol).
 """
-import binascii
-import codecs
+import asyncio
 import logging
 import socket
-import random
-from datetime import datetime, timedelta
-from typing import Any, Dict, List
+import time
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Union
 
 import construct
 
-from .exceptions import DeviceError, DeviceException, RecoverableError
-from .protocol import Message
+from .capture import RECV as RECV_DATAGRAM
+from .capture import SEND as SEND_DATAGRAM
+from .capture import PacketCapture, ReplayTransport
+from .exceptions import (
+    DeviceError,
+    DeviceException,
+    NoResponseError,
+    RecoverableError,
+)
+from .gateway import MiIOGateway
+from .handshake import HandshakeManager
+from .metrics import ProtocolMetrics
+from .ratelimit import RateLimiter
+from .request_templates import RequestTemplate
+from .retry import RetryPolicy, RetryState
+from .sequence import IdAllocator, call_waiter, message_id
+from .trace import RECV, SEND, HexBytes, PacketTracer
+from .protocol import CryptoContext, FastMessage, Message
 
 _LOGGER = logging.getLogger(__name__)
 
+# magic, length 32
+HELLO_BYTES = bytes.fromhex(
+    "21310020ffffffffffffffffffffffffffffffffffffffffffffffffffffffff"
+)
+# the round-trip times of handshakes are estimated under this name
+HANDSHAKE = "handshake"
+
 
 class MiIOProtocol:
+    """Blocking implementation of the miIO protocol.
+
+    Each instance owns a UDP socket connected to the device, which is opened on
+    first use and reused for all handshakes and commands until :func:`close` is
+    called or a socket error forces it to be reopened. The instance can also be
+    used as a context manager to close the socket on exit. Instances registered
+    with a :class:`MiIOGateway` use the socket of the gateway instead.
+    """
+
     def __init__(
         self,
         ip: str = None,
@@ -28,6 +59,14 @@ class MiIOProtocol:
         debug: int = 0,
         lazy_discover: bool = True,
         timeout: int = 5,
+        *,
+        handshake_ttl: Optional[float] = 600,
+        min_timeout: Optional[float] = 0.3,
+        retry_policy: RetryPolicy = None,
+        tracer: PacketTracer = None,
+        metrics: ProtocolMetrics = None,
+        rate_limiter: RateLimiter = None,
+        ids: IdAllocator = None,
     ) -> None:
         """Create a :class:`Device` instance.
 
@@ -35,23 +74,126 @@ class MiIOProtocol:
         :param token: Token used for encryption
         :param start_id: Running message id sent to the device
         :param debug: Wanted debug level
+        :param handshake_ttl: Seconds after which the handshake is renewed
+        :param min_timeout: Lower bound of the timeout adapted to the round-trip
+            times, None to always wait `timeout` seconds
+        :param retry_policy: Policy deciding on retries of failed requests
+        :param tracer: Packet tracer to record to, enabled by a debug level above 0
+            or by debug logging of the trace module
+        :param metrics: Metrics to count requests and round-trip times in
+        :param rate_limiter: Limiter spacing the requests, no limit if None
+        :param ids: Allocator of the message ids, starting after `start_id` if None
         """
         self.ip = ip
         self.port = 54321
         if token is None:
             token = 32 * "0"
         self.token = bytes.fromhex(token)
+        self._crypto: Optional[CryptoContext] = None
         self.debug = debug
         self.lazy_discover = lazy_discover
         self._timeout = timeout
-        self.__id = start_id
+        self.min_timeout = min_timeout
+        self.ids = ids if ids is not None else IdAllocator(start_id)
+
+        self._handshake = HandshakeManager(handshake_ttl)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.tracer = tracer if tracer is not None else PacketTracer(debug > 0)
+        self.metrics = metrics if metrics is not None else ProtocolMetrics()
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        # set to record all datagrams, or to answer requests from a capture
+        self.capture: Optional[PacketCapture] = None
+        self.replay: Optional[ReplayTransport] = None
+        # set by MiIOGateway.register
+        self.gateway: Optional[MiIOGateway] = None
+
+        self._socket: Optional[socket.socket] = None
+        # responses are received into this buffer instead of new bytes objects
+        self._buffer = memoryview(bytearray(4096))
+
+    def __enter__(self) -> "MiIOProtocol":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _get_socket(self) -> socket.socket:
+        """Return the socket connected to the device, creating it when necessary."""
+        if self._socket is None:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                s.settimeout(self._timeout)
+                s.connect((self.ip, self.port))
+            except OSError:
+                s.close()
+                raise
+            self._socket = s
+        return self._socket
+
+    def close(self) -> None:
+        """Close the socket, it will be reopened on the next request."""
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _exchange(
+        self, data: bytes, count: int = 1, hello: bool = False, timeout: float = None
+    ):
+        """Send the given packet `count` times and return the first response.
 
-        self._discovered = False
-        # these come from the device, but we initialize them here to make mypy happy
-        self._device_ts: datetime = datetime.utcnow()
-        self._device_id = bytes()
+        See :func:`_receive` for the response.
+        """
+        timeout = self._timeout if timeout is None else timeout
+        if self.replay is not None:
+            return self.replay.exchange(data, count, hello, timeout)
+        if self.gateway is not None and hello:
+            return self.gateway.handshake(self, data, count, timeout)
 
-    def send_handshake(self, *, retry_count=3) -> Message:
+        s = self._get_socket()
+        try:
+            for _ in range(count):
+                s.send(data)
+        except OSError:
+            self.close()
+            raise
+        self.metrics.sent(len(data), count)
+        if self.capture is not None:
+            self.capture.record(SEND_DATAGRAM, data, count)
+        return self._receive(hello, timeout)
+
+    def _receive(self, hello: bool, timeout: float):
+        """Return the next response of the awaited kind received in `timeout`.
+
+        Late answers of a different kind (handshake versus command response) than
+        awaited are skipped. The socket is closed on errors other than timeouts.
+        The response is a view into the receive buffer which is only valid until
+        the next exchange.
+        """
+        s = self._get_socket()
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                if timeout <= 0:
+                    raise socket.timeout("timed out")
+                if s.gettimeout() != timeout:
+                    s.settimeout(timeout)
+                size = s.recv_into(self._buffer)
+                self.metrics.received(size)
+                if self.capture is not None:
+                    self.capture.record(RECV_DATAGRAM, self._buffer[:size])
+                if (size == len(HELLO_BYTES)) == hello:
+                    return self._buffer[:size], (self.ip, self.port)
+                if hello:
+                    # a late answer to a command sent before the handshake
+                    self.metrics.stale_responses += 1
+                timeout = deadline - time.monotonic()
+        except socket.timeout:
+            raise
+        except OSError:
+            self.close()
+            raise
+
+    def send_handshake(self, *, retry_count=3, deadline: float = None) -> Message:
         """Send a handshake to the device.
 
         This returns some information, such as device type and serial,
@@ -60,32 +202,54 @@ class MiIOProtocol:
         The handshake must also be done regularly to enable communication
         with the device.
 
+        :param retry_count: How many times to retry in case of failure
+        :param deadline: Seconds all attempts have to finish in
         :raises DeviceException: if the device could not be discovered after retries.
         """
-        try:
-            m = MiIOProtocol.discover(self.ip)
-        except DeviceException as ex:
-            if retry_count > 0:
-                return self.send_handshake(retry_count=retry_count - 1)
-
-            raise ex
-
+        retry = self.retry_policy.start(retry_count, deadline)
+        while True:
+            try:
+                retry.next_attempt()
+                sent_at = time.monotonic()
+                data, _ = self._exchange(
+                    HELLO_BYTES,
+                    3,
+                    hello=True,
+                    timeout=self._attempt_timeout(retry, HANDSHAKE),
+                )
+                self._observe_rtt(HANDSHAKE, time.monotonic() - sent_at, retry)
+                return self._handle_handshake(FastMessage.parse(data))
+            except OSError as ex:
+                time.sleep(self._handshake_retry_delay(retry, ex))
+
+    def _handshake_retry_delay(self, retry: RetryState, ex: Exception) -> float:
+        """Return the delay before the next handshake or raise the final error."""
+        self.metrics.timeouts += 1
+        self.metrics.rto_for(HANDSHAKE).timed_out()
+        delay = retry.retry_delay(ex)
+        if delay is None:
+            _LOGGER.debug("Unable to discover a device at address %s: %s", self.ip, ex)
+            raise DeviceException("Unable to discover the device %s" % self.ip) from ex
+        self.metrics.retries += 1
+        return delay
+
+    def _handle_handshake(self, m: Optional[Message]) -> Message:
+        """Store device id and timestamp from the handshake response."""
         if m is None:
             _LOGGER.debug("Unable to discover a device at address %s", self.ip)
             raise DeviceException("Unable to discover the device %s" % self.ip)
 
         header = m.header.value
-        self._device_id = header.device_id
-        self._device_ts = header.ts
-        self._discovered = True
+        self._handshake.update(header.device_id, header.ts)
+        self.metrics.handshakes += 1
 
-        if self.debug > 1:
-            _LOGGER.debug(m)
+        if self.tracer.enabled:
+            self.tracer.record(RECV, (self.ip, self.port), None, m)
         _LOGGER.debug(
             "Discovered %s with ts: %s, token: %s",
-            binascii.hexlify(self._device_id).decode(),
-            self._device_ts,
-            codecs.encode(m.checksum, "hex"),
+            HexBytes(header.device_id),
+            header.ts,
+            HexBytes(m.checksum),
         )
 
         return m
@@ -100,25 +264,27 @@ class MiIOProtocol:
         :param str addr: Target IP address
         """
         is_broadcast = addr is None
-        seen_addrs = []  # type: List[str]
         if is_broadcast:
             addr = "<broadcast>"
             is_broadcast = True
             _LOGGER.info("Sending discovery to %s with timeout of %ss..", addr, timeout)
-        # magic, length 32
-        helobytes = bytes.fromhex(
-            "21310020ffffffffffffffffffffffffffffffffffffffffffffffffffffffff"
-        )
+        helobytes = HELLO_BYTES
 
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        s.settimeout(timeout)
-        for _ in range(3):
-            s.sendto(helobytes, (addr, 54321))
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            s.settimeout(timeout)
+            for _ in range(3):
+                s.sendto(helobytes, (addr, 54321))
+            return MiIOProtocol._read_discover_results(s, is_broadcast)
+
+    @staticmethod
+    def _read_discover_results(s: socket.socket, is_broadcast: bool) -> Any:
+        """Read handshake responses until timeout, or the first one for unicast."""
+        seen_addrs = []  # type: List[str]
         while True:
             try:
                 data, recv_addr = s.recvfrom(1024)
-                m = Message.parse(data)  # type: Message
+                m = FastMessage.parse(data)  # type: Message
                 _LOGGER.debug("Got a response: %s", m)
                 if not is_broadcast:
                     return m
@@ -127,8 +293,8 @@ class MiIOProtocol:
                     _LOGGER.info(
                         "  IP %s (ID: %s) - token: %s",
                         recv_addr[0],
-                        binascii.hexlify(m.header.value.device_id).decode(),
-                        codecs.encode(m.checksum, "hex"),
+                        HexBytes(m.header.value.device_id),
+                        HexBytes(m.checksum),
                     )
                     seen_addrs.append(recv_addr[0])
             except socket.timeout:
@@ -143,130 +309,234 @@ class MiIOProtocol:
         self,
         command: str,
         parameters: Any = None,
-        retry_count: int = 3,
+        retry_count: int = None,
         *,
-        extra_parameters: Dict = None
+        extra_parameters: Dict = None,
+        deadline: float = None,
+        retry: RetryState = None,
     ) -> Any:
         """Build and send the given command. Note that this will implicitly call
-        :func:`send_handshake` to do a handshake, and will re-try in case of errors
-        while incrementing the `_id` by 100.
+        :func:`send_handshake` to do a handshake when the previous one expired or
+        requests went unanswered, and will re-try in case of errors as decided by
+        the retry policy while skipping 100 message ids after timeouts.
 
         :param str command: Command to send
         :param dict parameters: Parameters to send, or an empty list
-        :param retry_count: How many times to retry in case of failure, how many handshakes to send
+        :param retry_count: How many times to retry in case of failure, the policy default if None
         :param dict extra_parameters: Extra top-level parameters
-        :raises DeviceException: if an error has occurred during communication.
+        :param float deadline: Seconds all attempts have to finish in
+        :param retry: State to make the attempts under, which tells the attempts
+            of the call afterwards, started from the retry policy with
+            `retry_count` and `deadline` if None
+        :raises DeviceException: if an error has occurred during communication,
+            with the number of attempts made in its `attempts`
         """
+        self.metrics.requests += 1
+        if retry is None:
+            retry = self.retry_policy.start(retry_count, deadline)
+        # late responses to earlier attempts answer the call as well
+        msg_ids: List[int] = []
+        try:
+            return self._send_attempts(
+                command, parameters, extra_parameters, retry, msg_ids
+            )
+        finally:
+            if self.gateway is not None:
+                self.gateway.release(self, msg_ids)
 
-        if not self.lazy_discover or not self._discovered:
-            self.send_handshake()
+    def _send_attempts(
+        self,
+        command: str,
+        parameters: Any,
+        extra_parameters: Dict,
+        retry: RetryState,
+        msg_ids: List[int],
+    ) -> Any:
+        while True:
+            try:
+                retry.next_attempt()
+                if not self.lazy_discover or not self._handshake.valid:
+                    self.send_handshake(deadline=retry.remaining())
+
+                self.rate_limiter.acquire()
+                request = self._create_request(command, parameters, extra_parameters)
+                m = self._build_message(request)
+
+                msg_ids.append(request["id"])
+                with self.ids.outstanding_request(request["id"]):
+                    sent_at = time.monotonic()
+                    m, addr = self._request(
+                        msg_ids, m, timeout=self._attempt_timeout(retry, command)
+                    )
+                self._observe_rtt(command, time.monotonic() - sent_at, retry)
+                result = self._handle_message(m, addr)
+            except Exception as ex:
+                time.sleep(self._retry_delay(retry, ex, command))
+                continue
+
+            self.rate_limiter.succeeded()
+            self._finish_attempts(retry)
+            return result
+
+    def _retry_delay(self, retry: RetryState, ex: Exception, command: str) -> float:
+        """Return the delay before the next attempt or raise the final error."""
+        timed_out = isinstance(ex, (OSError, asyncio.TimeoutError))
+        if timed_out:
+            # the device may have seen the following ids already
+            self.ids.skip(100)
+            self._handshake.failed()
+            self.metrics.timeouts += 1
+            self.metrics.rto_for(command).timed_out()
+        elif isinstance(ex, construct.core.ChecksumError):
+            self.metrics.checksum_errors += 1
+        elif isinstance(ex, RecoverableError):
+            self.metrics.recoverable_errors += 1
+            self.rate_limiter.overloaded()
+
+        delay = retry.retry_delay(ex)
+        if delay is not None:
+            self.metrics.retries += 1
+            _LOGGER.debug(
+                "Retrying in %.2fs after attempt %s failed: %r",
+                delay,
+                retry.attempts,
+                ex,
+            )
+            return delay
 
-        request = self._create_request(command, parameters, extra_parameters)
+        self._finish_attempts(retry)
+        self.metrics.failures += 1
+        error = self._final_error(ex, timed_out)
+        error.attempts = retry.attempts
+        if error is ex:
+            raise ex
+        raise error from ex
 
-        send_ts = self._device_ts + timedelta(seconds=1)
+    @staticmethod
+    def _final_error(ex: Exception, timed_out: bool) -> Exception:
+        """Return the exception to raise after the last attempt failed with `ex`."""
+        if isinstance(ex, construct.core.ChecksumError):
+            return DeviceException(
+                "Got checksum error which indicates use "
+                "of an invalid token. "
+                "Please check your token!"
+            )
+        if isinstance(ex, RecoverableError):
+            _LOGGER.error("Got error when receiving: %s", ex)
+            return DeviceException("Unable to recover failed command")
+        if timed_out:
+            _LOGGER.error("Got error when receiving: %s", ex)
+            return NoResponseError("No response from the device")
+        return ex
+
+    def _attempt_timeout(self, retry: RetryState, command: str) -> float:
+        """Return the timeout of the next attempt, adapted to the round-trip times
+        of the command."""
+        min_timeout = self._timeout if self.min_timeout is None else self.min_timeout
+        rto = self.metrics.rto_for(command)
+        return retry.timeout(rto.timeout(min_timeout, self._timeout))
+
+    def _observe_rtt(self, command: str, rtt: float, retry: RetryState) -> None:
+        self.metrics.observe_rtt(command, rtt)
+        # responses to retried requests may answer an earlier attempt, so only
+        # first attempts tell the round-trip time (Karn's algorithm)
+        if retry.attempts == 1:
+            self.metrics.rto_for(command).observe(rtt)
+
+    def _finish_attempts(self, retry: RetryState) -> None:
+        if retry.attempts > 1:
+            _LOGGER.debug("Request finished after %s attempts", retry.attempts)
+
+    def _build_message(self, request: Dict) -> bytes:
+        """Build an encrypted message for the given request payload."""
+        send_ts = self._handshake.ts + timedelta(seconds=1)
         header = {
             "length": 0,
             "unknown": 0x00000000,
-            "device_id": self._device_id,
+            "device_id": self._handshake.device_id,
             "ts": send_ts,
         }
 
         msg = {"data": {"value": request}, "header": {"value": header}, "checksum": 0}
-        m = Message.build(msg, token=self.token)
-        _LOGGER.debug("%s:%s >>: %s", self.ip, self.port, request)
-        if self.debug > 1:
-            _LOGGER.debug(
-                "send (timeout %s): %s",
-                self._timeout,
-                Message.parse(m, token=self.token),
-            )
-
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.settimeout(self._timeout)
-
-        try:
-            s.sendto(m, (self.ip, self.port))
-        except OSError as ex:
-            _LOGGER.error("failed to send msg: %s", ex)
-            raise DeviceException from ex
-
-        try:
-            data, addr = s.recvfrom(4096)
-            m = Message.parse(data, token=self.token)
+        m = FastMessage.build(msg, token=self.crypto)
+        if self.tracer.enabled:
+            self.tracer.record(SEND, (self.ip, self.port), request, m)
 
-            header = m.header.value
-            payload = m.data.value
-
-            self.__id = payload["id"]
-            self._device_ts = header["ts"]  # type: ignore  # ts uses timeadapter
-
-            if self.debug > 1:
-                _LOGGER.debug("recv from %s: %s", addr[0], m)
+        return m
 
-            _LOGGER.debug(
-                "%s:%s (ts: %s, id: %s) << %s",
-                self.ip,
-                self.port,
-                header["ts"],
-                payload["id"],
-                payload,
-            )
-            if "error" in payload:
-                self._handle_error(payload["error"])
+    def _request(self, msg_ids: List[int], data: bytes, timeout: float):
+        """Send a request and return its parsed response with the address.
 
-            try:
-                return payload["result"]
-            except KeyError:
-                return payload
-        except construct.core.ChecksumError as ex:
-            raise DeviceException(
-                "Got checksum error which indicates use "
-                "of an invalid token. "
-                "Please check your token!"
-            ) from ex
-        except OSError as ex:
-            if retry_count > 0:
+        Responses to any attempt of the call, whose ids are given with the one of
+        this request last, are accepted. Responses with other ids answer earlier
+        calls which timed out, they are counted and skipped like responses whose
+        payload could not be decoded. Replayed responses
+        are returned regardless of their id, which is not the one of the replayed
+        request.
+        """
+        if self.replay is not None:
+            data, addr = self.replay.exchange(data, timeout=timeout)
+            return FastMessage.parse(data, token=self.crypto), addr
+        if self.gateway is not None:
+            return self.gateway.request(self, msg_ids, data, timeout)
+
+        deadline = time.monotonic() + timeout
+        data, addr = self._exchange(data, timeout=timeout)
+        while True:
+            m = FastMessage.parse(data, token=self.crypto)
+            msg_id = message_id(m)
+            if msg_id in msg_ids:
+                return m, addr
+            if msg_id is None:
+                _LOGGER.debug("Discarding response without a message id")
+                self.metrics.invalid_responses += 1
+            else:
                 _LOGGER.debug(
-                    "Retrying with incremented id, retries left: %s", retry_count
-                )
-                self.__id += 100
-                self._discovered = False
-                return self.send(
-                    command,
-                    parameters,
-                    retry_count - 1,
-                    extra_parameters=extra_parameters,
+                    "Discarding response to %s while waiting for %s", msg_id, msg_ids
                 )
+                self.metrics.stale_responses += 1
+            data, addr = self._receive(False, deadline - time.monotonic())
 
-            _LOGGER.error("Got error when receiving: %s", ex)
-            raise DeviceException("No response from the device") from ex
+    def _handle_message(self, m: Message, addr) -> Any:
+        """Return the result of a parsed response.
 
-        except RecoverableError as ex:
-            if retry_count > 0:
-                _LOGGER.debug(
-                    "Retrying to send failed command, retries left: %s", retry_count
-                )
-                return self.send(
-                    command,
-                    parameters,
-                    retry_count - 1,
-                    extra_parameters=extra_parameters,
-                )
+        :raises DeviceError: if the device responded with an error.
+        """
+        header = m.header.value
+        payload = m.data.value
 
-            _LOGGER.error("Got error when receiving: %s", ex)
-            raise DeviceException("Unable to recover failed command") from ex
+        self._handshake.observe(header["ts"])  # type: ignore  # ts uses timeadapter
+
+        if self.tracer.enabled:
+            self.tracer.record(RECV, addr, payload, m)
+        if "error" in payload:
+            self._handle_error(payload["error"])
+
+        try:
+            return payload["result"]
+        except KeyError:
+            return payload
 
     @property
     def _id(self) -> int:
         """Increment and return the sequence id."""
-        self.__id += random.randint(1, 1000)
-        if self.__id >= 9999:
-            self.__id = 1
-        return self.__id
+        return self.ids.next_id()
+
+    @property
+    def crypto(self) -> CryptoContext:
+        """Key material of the token, derived once per protocol instead of being
+        looked up per packet, so that it is kept however many devices are used."""
+        if self._crypto is None:
+            self._crypto = CryptoContext(self.token)
+        return self._crypto
 
     @property
     def raw_id(self):
-        return self.__id
+        return self.ids.last
+
+    @raw_id.setter
+    def raw_id(self, value: int):
+        self.ids.last = value
 
     def _handle_error(self, error):
         """Raise exception based on the given error code."""
@@ -277,7 +547,16 @@ class MiIOProtocol:
     def _create_request(
         self, command: str, parameters: Any, extra_parameters: Dict = None
     ):
-        """Create request payload."""
+        """Create request payload.
+
+        A :class:`RequestTemplate` as the parameters is sent as serialized in
+        advance, unless the command or the extra parameters differ from it.
+        """
+        if isinstance(parameters, RequestTemplate):
+            if extra_parameters is None and parameters.method == command:
+                return parameters.prepare(self._id)
+            parameters = list(parameters.params)
+
         request = {"id": self._id, "method": command}
 
         if parameters is not None:
@@ -289,3 +568,303 @@ class MiIOProtocol:
             request = {**request, **extra_parameters}
 
         return request
+
+
+class _MiIODatagramProtocol(asyncio.DatagramProtocol):
+    """Datagram endpoint dispatching received packets to waiting futures.
+
+    Handshake responses resolve the pending handshake, command responses are
+    matched to their request by the message id. Packets nobody waits for are late
+    answers and get dropped.
+    """
+
+    def __init__(
+        self,
+        token: Union[bytes, CryptoContext],
+        metrics: ProtocolMetrics,
+        capture: Optional[PacketCapture] = None,
+    ) -> None:
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.capture = capture
+        self._token = token
+        self._metrics = metrics
+        self._hello: Optional[asyncio.Future] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def connection_lost(self, exc) -> None:
+        self.transport = None
+        self._wake(exc or ConnectionError("Connection lost"))
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self._metrics.received(len(data))
+        if self.capture is not None:
+            self.capture.record(RECV_DATAGRAM, data)
+        if len(data) == len(HELLO_BYTES):
+            if self._hello is not None and not self._hello.done():
+                self._hello.set_result((data, addr))
+            return
+
+        if not self._pending:
+            self._metrics.stale_responses += 1
+            return
+
+        try:
+            m = FastMessage.parse(data, token=self._token)
+        except Exception as ex:
+            _LOGGER.debug("Dropping unreadable response: %s", ex)
+            self._metrics.invalid_responses += 1
+            return
+        msg_id = message_id(m)
+        if msg_id is None:
+            _LOGGER.debug("Dropping response without a message id")
+            self._metrics.invalid_responses += 1
+            return
+
+        waiter = self._pending.get(msg_id)
+        if waiter is None or waiter.done():
+            _LOGGER.debug("Dropping response to unknown request id %s", msg_id)
+            self._metrics.stale_responses += 1
+            return
+        waiter.set_result((m, addr))
+
+    def error_received(self, exc) -> None:
+        self._wake(exc)
+
+    def _wake(self, exc: Exception) -> None:
+        for waiter in [*self._pending.values(), self._hello]:
+            if waiter is not None and not waiter.done():
+                waiter.set_exception(exc)
+                # calls between two attempts do not await their waiter
+                waiter.exception()
+
+    async def recv_hello(self, timeout: float):
+        """Wait for the next handshake response, at most `timeout` seconds."""
+        self._hello = asyncio.get_running_loop().create_future()
+        try:
+            return await asyncio.wait_for(self._hello, timeout)
+        finally:
+            self._hello = None
+
+    def sendto(self, data: bytes, count: int = 1) -> None:
+        """Send the given packet `count` times."""
+        for _ in range(count):
+            self.transport.sendto(data)
+        self._metrics.sent(len(data), count)
+        if self.capture is not None:
+            self.capture.record(SEND_DATAGRAM, data, count)
+
+    async def request(self, msg_ids: List[int], data: bytes, timeout: float):
+        """Send a request and wait for its response, at most `timeout` seconds.
+
+        The responses to the attempts of the call are awaited until it is
+        released with :func:`release`, see :func:`call_waiter`.
+
+        :param msg_ids: Ids of the attempts of the call, the one of this request last
+        """
+        waiter = call_waiter(
+            self._pending, msg_ids, asyncio.get_running_loop().create_future
+        )
+        if not waiter.done():
+            self.sendto(data)
+        return await asyncio.wait_for(asyncio.shield(waiter), timeout)
+
+    def release(self, msg_ids: List[int]) -> None:
+        """Stop awaiting the responses to the attempts of a finished call."""
+        for msg_id in msg_ids:
+            waiter = self._pending.pop(msg_id, None)
+            if waiter is not None:
+                waiter.cancel()
+
+
+class AsyncMiIOProtocol(MiIOProtocol):
+    """Asyncio implementation of :class:`MiIOProtocol`.
+
+    Handshakes and commands are sent through a datagram endpoint on the running
+    event loop, so no executor thread is blocked while waiting for the device.
+    Up to `max_in_flight` requests are sent without waiting for the previous
+    responses, which are matched to their requests by the message id.
+
+    :func:`start_keepalive` renews the handshake in the background before it
+    expires, so that commands do not have to wait for it.
+    """
+
+    def __init__(self, *args, max_in_flight: int = 1, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.max_in_flight = max_in_flight
+        self._endpoint: Optional[_MiIODatagramProtocol] = None
+        self._window: Optional[asyncio.Semaphore] = None
+        self._handshake_lock: Optional[asyncio.Lock] = None
+        self._keepalive: Optional[asyncio.Task] = None
+
+    def _create_locks(self) -> None:
+        # created on first use to bind them to the running loop
+        if self._window is None:
+            self._window = asyncio.Semaphore(self.max_in_flight)
+            self._handshake_lock = asyncio.Lock()
+
+    def start_keepalive(self) -> None:
+        """Renew the handshake in the background shortly before it expires.
+
+        This needs to be called from the event loop, the task is stopped by
+        :func:`close`.
+        """
+        if self._handshake.ttl is None:
+            return
+        if self._keepalive is None or self._keepalive.done():
+            self._keepalive = asyncio.get_running_loop().create_task(
+                self._run_keepalive()
+            )
+
+    async def _run_keepalive(self) -> None:
+        self._create_locks()
+        while True:
+            await asyncio.sleep(
+                max(self._handshake.expires_in - self._timeout, self._timeout)
+            )
+            async with self._handshake_lock:
+                if self._handshake.expires_in > self._timeout:
+                    continue
+                try:
+                    await self.send_handshake()
+                except DeviceException as ex:
+                    _LOGGER.debug("Keepalive handshake failed: %s", ex)
+
+    async def _get_endpoint(self) -> _MiIODatagramProtocol:
+        """Return the datagram endpoint, creating it when necessary."""
+        if self.replay is not None:
+            return self.replay  # type: ignore[return-value]
+        if self._endpoint is None or self._endpoint.transport is None:
+            loop = asyncio.get_running_loop()
+            _, self._endpoint = await loop.create_datagram_endpoint(
+                lambda: _MiIODatagramProtocol(self.crypto, self.metrics),
+                remote_addr=(self.ip, self.port),
+            )
+        # the capture may be switched at any time
+        self._endpoint.capture = self.capture
+        return self._endpoint
+
+    def close(self) -> None:
+        """Close the datagram endpoint and stop the keepalive."""
+        super().close()
+        if self._keepalive is not None:
+            self._keepalive.cancel()
+            self._keepalive = None
+        self._close_endpoint()
+
+    def _close_endpoint(self) -> None:
+        if self._endpoint is not None and self._endpoint.transport is not None:
+            self._endpoint.transport.close()
+        self._endpoint = None
+
+    async def send_handshake(  # type: ignore[override]
+        self, *, retry_count=3, deadline: float = None
+    ) -> Message:
+        """Send a handshake to the device, see :func:`MiIOProtocol.send_handshake`.
+
+        :raises DeviceException: if the device could not be discovered after retries.
+        """
+        retry = self.retry_policy.start(retry_count, deadline)
+        while True:
+            try:
+                retry.next_attempt()
+                endpoint = await self._get_endpoint()
+                sent_at = time.monotonic()
+                endpoint.sendto(HELLO_BYTES, 3)
+                data, _ = await endpoint.recv_hello(
+                    self._attempt_timeout(retry, HANDSHAKE)
+                )
+                self._observe_rtt(HANDSHAKE, time.monotonic() - sent_at, retry)
+                return self._handle_handshake(FastMessage.parse(data))
+            except (OSError, asyncio.TimeoutError) as ex:
+                try:
+                    delay = self._handshake_retry_delay(retry, ex)
+                except DeviceException:
+                    self._close_endpoint()
+                    raise
+                await asyncio.sleep(delay)
+
+    async def send(  # type: ignore[override]
+        self,
+        command: str,
+        parameters: Any = None,
+        retry_count: int = None,
+        *,
+        extra_parameters: Dict = None,
+        deadline: float = None,
+        retry: RetryState = None,
+    ) -> Any:
+        """Build and send the given command, see :func:`MiIOProtocol.send`.
+
+        :raises DeviceException: if an error has occurred during communication.
+        """
+        self._create_locks()
+        self.metrics.requests += 1
+        async with self._window:
+            if retry is None:
+                retry = self.retry_policy.start(retry_count, deadline)
+            msg_ids: List[int] = []
+            try:
+                return await self._send_attempts(
+                    command, parameters, extra_parameters, retry, msg_ids
+                )
+            finally:
+                if self._endpoint is not None:
+                    self._endpoint.release(msg_ids)
+
+    async def _send_attempts(  # type: ignore[override]
+        self,
+        command: str,
+        parameters: Any,
+        extra_parameters: Dict,
+        retry: RetryState,
+        msg_ids: List[int],
+    ) -> Any:
+        while True:
+            try:
+                retry.next_attempt()
+                await self.rate_limiter.async_acquire()
+                result = await self._send(
+                    command, parameters, extra_parameters, retry, msg_ids
+                )
+            except Exception as ex:
+                try:
+                    delay = self._retry_delay(retry, ex, command)
+                except DeviceException:
+                    if isinstance(ex, (OSError, asyncio.TimeoutError)):
+                        self._close_endpoint()
+                    raise
+                await asyncio.sleep(delay)
+                continue
+
+            self.rate_limiter.succeeded()
+            self._finish_attempts(retry)
+            return result
+
+    async def _send(
+        self,
+        command: str,
+        parameters: Any,
+        extra_parameters: Dict,
+        retry: RetryState,
+        msg_ids: List[int],
+    ) -> Any:
+        if not self.lazy_discover or not self._handshake.valid:
+            async with self._handshake_lock:
+                if not self.lazy_discover or not self._handshake.valid:
+                    await self.send_handshake(deadline=retry.remaining())
+
+        endpoint = await self._get_endpoint()
+        request = self._create_request(command, parameters, extra_parameters)
+        m = self._build_message(request)
+
+        msg_ids.append(request["id"])
+        with self.ids.outstanding_request(request["id"]):
+            sent_at = time.monotonic()
+            m, addr = await endpoint.request(
+                msg_ids, m, self._attempt_timeout(retry, command)
+            )
+        self._observe_rtt(command, time.monotonic() - sent_at, retry)
+        return self._handle_message(m, addr)
@@ -1,13 +1,21 @@
+import asyncio
 import logging
 from enum import Enum
 from functools import partial
-from typing import Any, Dict, Union
+from typing import Any, Dict, Optional, Union
 
 import click
 
 from .click_common import EnumType, LiteralParamType, command
 from .device import Device, DeviceStatus  # noqa: F401
-from .exceptions import DeviceException
+from .exceptions import DeviceException, PartialResultError
+from .polling import PropertyScheduler
+from .property_limits import (
+    PropertyLimitCache,
+    ProbeStep,
+    probe_max_properties,
+)
+from .request_templates import CompiledMapping
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -26,11 +34,26 @@ class MiotValueType(Enum):
 
 MiotMapping = Dict[str, Dict[str, Any]]
 
+# properties per request until the limit of the device is known
+DEFAULT_MAX_PROPERTIES = 15
+
 
 class MiotDevice(Device):
-    """Main class representing a MIoT device."""
+    """Main class representing a MIoT device.
+
+    The ``async_`` counterparts of the methods send the same requests without
+    blocking the event loop.
+    """
 
     mapping: MiotMapping
+    # file the probed property limits are kept in, None to probe after every start;
+    # Home Assistant sets a file in its storage directory
+    max_properties_cache: Optional[str] = None
+    # longest seconds between reads of rarely changing properties, the
+    # properties not listed are read on every poll
+    poll_intervals: Dict[str, float] = {}
+    # longest seconds written values are returned while the device cannot be read
+    write_ttl = 10.0
 
     def __init__(
         self,
@@ -42,9 +65,18 @@ class MiotDevice(Device):
         timeout: int = None,
         *,
         mapping: MiotMapping = None,
+        max_in_flight: int = None,
     ):
-        """Overloaded to accept keyword-only `mapping` parameter."""
-        super().__init__(ip, token, start_id, debug, lazy_discover, timeout)
+        """Overloaded to accept keyword-only `mapping` and `max_in_flight`."""
+        super().__init__(
+            ip,
+            token,
+            start_id,
+            debug,
+            lazy_discover,
+            timeout,
+            max_in_flight=max_in_flight,
+        )
 
         if mapping is None and not hasattr(self, "mapping"):
             raise DeviceException(
@@ -54,17 +86,138 @@ class MiotDevice(Device):
         if mapping is not None:
             self.mapping = mapping
 
-    def get_properties_for_mapping(self, *, max_properties=15) -> list:
-        """Retrieve raw properties based on mapping."""
+        self._compiled = CompiledMapping(self.mapping)
+        self._max_properties: Optional[int] = None
+        self._scheduler = PropertyScheduler(self.poll_intervals, self.write_ttl)
+
+    def get_properties_for_mapping(self, *, max_properties=None, full=False) -> list:
+        """Retrieve raw properties based on mapping.
 
-        # We send property key in "did" because it's sent back via response and we can identify the property.
-        properties = [
-            {"did": k, **v} for k, v in self.mapping.items() if "aiid" not in v
+        If `max_properties` is None, the properties are requested in slices as large
+        as the device accepts, see :func:`probe_max_properties`.
+
+        Properties listed in `poll_intervals` are only requested when their
+        interval has passed, their last values are returned otherwise. Set `full`
+        to request all properties.
+
+        The properties of slices which failed while others succeeded are returned
+        with an error code, so that only they read as unavailable.
+        """
+        properties = self._mapping_properties()
+        if max_properties is None:
+            if self._max_properties is None:
+                self.probe_max_properties()
+            max_properties = self._max_properties
+        due = properties if full else self._scheduler.due(properties)
+        try:
+            values = self.get_properties(
+                due,
+                property_getter="get_properties",
+                max_properties=max_properties,
+            )
+        except PartialResultError as ex:
+            _LOGGER.warning("Unable to read all properties: %s", ex)
+            values = self._fill_failed_properties(due, ex)
+        return self._scheduler.update(properties, values)
+
+    async def async_get_properties_for_mapping(
+        self, *, max_properties=None, full=False
+    ) -> list:
+        properties = self._mapping_properties()
+        if max_properties is None:
+            if self._max_properties is None:
+                await self.async_probe_max_properties()
+            max_properties = self._max_properties
+        due = properties if full else self._scheduler.due(properties)
+        try:
+            values = await self.async_get_properties(
+                due,
+                property_getter="get_properties",
+                max_properties=max_properties,
+            )
+        except PartialResultError as ex:
+            _LOGGER.warning("Unable to read all properties: %s", ex)
+            values = self._fill_failed_properties(due, ex)
+        return self._scheduler.update(properties, values)
+
+    @staticmethod
+    def _fill_failed_properties(properties: list, ex: PartialResultError) -> list:
+        return [
+            {**prop, "code": -1} if value is None else value
+            for prop, value in zip(properties, ex.values)
         ]
 
-        return self.get_properties(
-            properties, property_getter="get_properties", max_properties=max_properties
-        )
+    @command()
+    def probe_max_properties(self) -> Optional[int]:
+        """Find the number of properties the device answers per request.
+
+        The limit is cached per model and firmware version in the file given by
+        `max_properties_cache`, and used for the following requests of
+        :func:`get_properties_for_mapping`. None is returned if the probing failed,
+        the following requests then use `DEFAULT_MAX_PROPERTIES` without probing
+        again.
+        """
+        steps = self._probe_steps()
+        try:
+            method, params = next(steps)
+            while True:
+                if callable(method):
+                    result = method(*params)
+                else:
+                    try:
+                        result = self.send(method, params)
+                    except DeviceException as ex:
+                        result = ex
+                method, params = steps.send(result)
+        except StopIteration as stop:
+            return self._probed(stop.value)
+
+    async def async_probe_max_properties(self) -> Optional[int]:
+        # the limit cache is read and written in the default executor
+        loop = asyncio.get_running_loop()
+        steps = self._probe_steps()
+        try:
+            method, params = next(steps)
+            while True:
+                if callable(method):
+                    result = await loop.run_in_executor(None, method, *params)
+                else:
+                    try:
+                        result = await self.async_send(method, params)
+                    except DeviceException as ex:
+                        result = ex
+                method, params = steps.send(result)
+        except StopIteration as stop:
+            return self._probed(stop.value)
+
+    def _probed(self, limit: Optional[int]) -> Optional[int]:
+        if limit is None:
+            _LOGGER.warning(
+                "Unable to probe the properties per request, using %s",
+                DEFAULT_MAX_PROPERTIES,
+            )
+        self._max_properties = limit or DEFAULT_MAX_PROPERTIES
+        return limit
+
+    def _probe_steps(self) -> ProbeStep:
+        cache = None
+        if self.max_properties_cache is not None:
+            cache = PropertyLimitCache(self.max_properties_cache)
+        return probe_max_properties(self._mapping_properties(), cache)
+
+    def _mapping_properties(self) -> tuple:
+        """Return the property requests for all properties in the mapping."""
+        return self._compiled.properties
+
+    def _slice_properties(self, properties, max_properties) -> list:
+        """Overloaded to request the properties of the mapping with the templates
+        built for them, see :class:`CompiledMapping`."""
+        if not properties:
+            return []
+        templates = self._compiled.slices(properties, max_properties)
+        if templates is None:
+            return super()._slice_properties(properties, max_properties)
+        return templates
 
     @command(
         click.argument("name", type=str),
@@ -72,6 +225,15 @@ class MiotDevice(Device):
     )
     def call_action(self, name: str, params=None):
         """Call an action by a name in the mapping."""
+        action = self._get_action(name)
+        return self.call_action_by(action["siid"], action["aiid"], params)
+
+    async def async_call_action(self, name: str, params=None):
+        action = self._get_action(name)
+        return await self.async_call_action_by(action["siid"], action["aiid"], params)
+
+    def _get_action(self, name: str) -> Dict[str, Any]:
+        """Return the mapping entry of the given action."""
         if name not in self.mapping:
             raise DeviceException(f"Unable to find {name} in the mapping")
 
@@ -80,7 +242,7 @@ class MiotDevice(Device):
         if "siid" not in action or "aiid" not in action:
             raise DeviceException(f"{name} is not an action (missing siid or aiid)")
 
-        return self.call_action_by(action["siid"], action["aiid"], params)
+        return action
 
     @command(
         click.argument("siid", type=int),
@@ -89,17 +251,22 @@ class MiotDevice(Device):
     )
     def call_action_by(self, siid, aiid, params=None):
         """Call an action."""
+        return self.send("action", self._action_payload(siid, aiid, params))
+
+    async def async_call_action_by(self, siid, aiid, params=None):
+        return await self.async_send("action", self._action_payload(siid, aiid, params))
+
+    @staticmethod
+    def _action_payload(siid, aiid, params=None) -> Dict[str, Any]:
         if params is None:
             params = []
-        payload = {
+        return {
             "did": f"call-{siid}-{aiid}",
             "siid": siid,
             "aiid": aiid,
             "in": params,
         }
 
-        return self.send("action", payload)
-
     @command(
         click.argument("siid", type=int),
         click.argument("piid", type=int),
@@ -139,8 +306,131 @@ class MiotDevice(Device):
         )
 
     def set_property(self, property_key: str, value):
-        """Sets property value using the existing mapping."""
-        return self.send(
+        """Sets property value using the existing mapping.
+
+        The value is returned by :func:`get_properties_for_mapping` and
+        :func:`cached_properties` right away once the device accepted it, until
+        the property read back from the device replaces it.
+        """
+        result = self.send(
             "set_properties",
             [{"did": property_key, **self.mapping[property_key], "value": value}],
         )
+        self._read_back(self._record_writes(result, {property_key: value}))
+        return result
+
+    async def async_set_property(self, property_key: str, value):
+        result = await self.async_send(
+            "set_properties",
+            [{"did": property_key, **self.mapping[property_key], "value": value}],
+        )
+        await self._async_read_back(self._record_writes(result, {property_key: value}))
+        return result
+
+    @command(click.argument("values", type=LiteralParamType()))
+    def set_properties(self, values: Dict[str, Any]) -> Dict[str, int]:
+        """Set several properties of the mapping at once.
+
+        The properties are sent in a single ``set_properties`` request, or in as
+        few as the number of properties the device accepts per request allows.
+        Accepted values are recorded like by :func:`set_property`.
+
+        :param values: Values by property name
+        :return: Result code by property name, 0 if the value was set, -1 for the
+            properties whose request failed
+        :raises DeviceException: if all requests failed
+        """
+        params = self._set_properties_params(values)
+        try:
+            result = self.get_properties(
+                params,
+                property_getter="set_properties",
+                max_properties=self._max_properties or DEFAULT_MAX_PROPERTIES,
+            )
+        except PartialResultError as ex:
+            _LOGGER.warning("Unable to set all properties: %s", ex)
+            result = self._fill_failed_properties(params, ex)
+        self._read_back(self._record_writes(result, values))
+        return self._result_codes(values, result)
+
+    async def async_set_properties(self, values: Dict[str, Any]) -> Dict[str, int]:
+        params = self._set_properties_params(values)
+        try:
+            result = await self.async_get_properties(
+                params,
+                property_getter="set_properties",
+                max_properties=self._max_properties or DEFAULT_MAX_PROPERTIES,
+            )
+        except PartialResultError as ex:
+            _LOGGER.warning("Unable to set all properties: %s", ex)
+            result = self._fill_failed_properties(params, ex)
+        await self._async_read_back(self._record_writes(result, values))
+        return self._result_codes(values, result)
+
+    def _set_properties_params(self, values: Dict[str, Any]) -> list:
+        for key in values:
+            if key not in self.mapping or "piid" not in self.mapping[key]:
+                raise DeviceException(f"{key} is not a property of the mapping")
+        return [
+            {"did": key, **self.mapping[key], "value": value}
+            for key, value in values.items()
+        ]
+
+    @staticmethod
+    def _result_codes(values: Dict[str, Any], result: list) -> Dict[str, int]:
+        """Return the result code of every property, -1 if it is missing."""
+        codes = dict.fromkeys(values, -1)
+        for item in result:
+            if item.get("did") in codes:
+                codes[item["did"]] = item.get("code", -1)
+        return codes
+
+    def _record_writes(self, result, values: Dict[str, Any]) -> list:
+        """Record the values the device accepted according to the result and
+        return the requests to read them back with."""
+        written = []
+        for item in result if isinstance(result, list) else []:
+            did = item.get("did")
+            if item.get("code") == 0 and did in values:
+                self._scheduler.write(did, values[did])
+                written.append(did)
+        return [prop for prop in self._mapping_properties() if prop["did"] in written]
+
+    def _read_back(self, properties: list) -> None:
+        """Read the written properties, so that the values the device reports
+        replace the written ones."""
+        if not properties:
+            return
+        try:
+            values = self.get_properties(
+                properties,
+                property_getter="get_properties",
+                max_properties=self._max_properties or DEFAULT_MAX_PROPERTIES,
+            )
+        except PartialResultError as ex:
+            values = self._fill_failed_properties(properties, ex)
+        except DeviceException as ex:
+            _LOGGER.debug("Unable to read back the written properties: %s", ex)
+            return
+        self._scheduler.confirm(values)
+
+    async def _async_read_back(self, properties: list) -> None:
+        if not properties:
+            return
+        try:
+            values = await self.async_get_properties(
+                properties,
+                property_getter="get_properties",
+                max_properties=self._max_properties or DEFAULT_MAX_PROPERTIES,
+            )
+        except PartialResultError as ex:
+            values = self._fill_failed_properties(properties, ex)
+        except DeviceException as ex:
+            _LOGGER.debug("Unable to read back the written properties: %s", ex)
+            return
+        self._scheduler.confirm(values)
+
+    def cached_properties(self) -> list:
+        """Return the values of the last poll of the mapped properties, updated
+        with the values written since, without requesting anything."""
+        return self._scheduler.snapshot()
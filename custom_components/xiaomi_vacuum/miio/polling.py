@@ -0,0 +1,153 @@
+"""Tiered polling of MIoT properties.
+
+Many properties of a device change rarely or never, such as serial numbers,
+settings or consumable lifetimes. :class:`PropertyScheduler` reads such cold
+properties only every so often and merges their last values into every poll,
+so that a poll only requests the properties which change frequently.
+
+The interval of a cold property adapts to how often it is seen changing: it is
+halved when a refresh finds a new value and doubled back towards the configured
+interval when the value is unchanged.
+
+Values written to the device are recorded as well and returned right away, until
+the device reports the property again: the value read then replaces the written
+one, so that a value the device clamped or ignored does not linger. Written
+values are dropped after a while if the property cannot be read.
+"""
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .request_templates import PropertyRequest
+
+
+class PropertyScheduler:
+    """Decide which properties to read on a poll and keep the others' values.
+
+    Properties are identified by their ``did``. Properties without an interval
+    are read on every poll.
+    """
+
+    def __init__(self, intervals: Dict[str, float], write_ttl: float = 10.0) -> None:
+        """
+        :param intervals: Longest seconds between reads per property name
+        :param write_ttl: Seconds a written value is returned at most while the
+            property is not read
+        """
+        self.intervals = dict(intervals)
+        self.write_ttl = write_ttl
+        # the learned intervals, at most the configured ones
+        self.current = dict(intervals)
+        self._values: Dict[str, PropertyRequest] = {}
+        self._read_at: Dict[str, float] = {}
+        # the written values and when they expire
+        self._written: Dict[str, Tuple[Any, float]] = {}
+        # the values returned by the last poll
+        self._last: List[PropertyRequest] = []
+
+    def due(
+        self, properties: List[PropertyRequest], now: Optional[float] = None
+    ) -> List[PropertyRequest]:
+        """Return the properties which need to be read now."""
+        now = time.monotonic() if now is None else now
+        return [
+            prop
+            for prop in properties
+            if prop["did"] not in self.current
+            or prop["did"] not in self._read_at
+            or now - self._read_at[prop["did"]] >= self.current[prop["did"]]
+        ]
+
+    def update(
+        self,
+        properties: List[PropertyRequest],
+        values: List[PropertyRequest],
+        now: Optional[float] = None,
+    ) -> List[PropertyRequest]:
+        """Store the values read and return the values of all properties.
+
+        Properties which were not read, or failed to be read, get their last
+        value if there is one.
+
+        :param properties: All properties of the poll, in the order to return
+        :param values: Values of the properties which were read
+        """
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        for value in values:
+            did = value.get("did")
+            if value.get("code") != 0:
+                continue
+            self._written.pop(did, None)
+            if did not in self.current:
+                continue
+            previous = self._values.get(did)
+            if previous is not None:
+                self._adapt(did, previous.get("value") != value.get("value"))
+            self._values[did] = value
+            self._read_at[did] = now
+
+        read = {value.get("did"): value for value in values}
+        merged = []
+        for prop in properties:
+            did = prop["did"]
+            value = read.get(did)
+            if (value is None or value.get("code") != 0) and did in self._values:
+                value = self._values[did]
+            # -1 marks properties without any value like other failed reads
+            merged.append(value if value is not None else {**prop, "code": -1})
+        self._last = merged
+        return self._with_writes(merged)
+
+    def write(self, did: str, value: Any, now: Optional[float] = None) -> None:
+        """Record a value successfully written to the device."""
+        now = time.monotonic() if now is None else now
+        self._written[did] = (value, now + self.write_ttl)
+        self._read_at.pop(did, None)
+
+    def confirm(
+        self, values: List[PropertyRequest], now: Optional[float] = None
+    ) -> None:
+        """Store the values of written properties read back from the device, in
+        place of the written values."""
+        now = time.monotonic() if now is None else now
+        read = {value.get("did"): value for value in values if value.get("code") == 0}
+        for did, value in read.items():
+            self._written.pop(did, None)
+            if did in self.current:
+                self._values[did] = value
+                self._read_at[did] = now
+        self._last = [read.get(value.get("did"), value) for value in self._last]
+
+    def snapshot(self, now: Optional[float] = None) -> List[PropertyRequest]:
+        """Return the values of the last poll updated with the values written
+        since, without reading from the device."""
+        self._expire(time.monotonic() if now is None else now)
+        return self._with_writes(self._last)
+
+    def _expire(self, now: float) -> None:
+        for did, (_, expires_at) in list(self._written.items()):
+            if expires_at <= now:
+                del self._written[did]
+
+    def _with_writes(self, values: List[PropertyRequest]) -> List[PropertyRequest]:
+        if not self._written:
+            return values
+        return [
+            {**value, "code": 0, "value": self._written[value["did"]][0]}
+            if value.get("did") in self._written
+            else value
+            for value in values
+        ]
+
+    def _adapt(self, did: str, changed: bool) -> None:
+        if changed:
+            self.current[did] /= 2
+        else:
+            self.current[did] = min(self.current[did] * 2, self.intervals[did])
+
+    def invalidate(self, did: Optional[str] = None) -> None:
+        """Read the given property, or all properties, on the next poll."""
+        if did is None:
+            self._read_at.clear()
+        else:
+            self._read_at.pop(did, None)
@@ -0,0 +1,138 @@
+"""Number of properties a device accepts per request.
+
+Firmwares differ in how many properties they answer in a single
+``get_properties`` request. :func:`probe_max_properties` finds the limit with a
+binary search, and :class:`PropertyLimitCache` keeps the results on disk per
+model and firmware version, so that the search is done once per firmware.
+
+Some firmwares do not answer requests above their limit at all, so a request
+timing out after all its retries is taken as a rejection, except for requests
+of a single property. As a timeout may as well be packet loss, limits found
+this way are not cached.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple, Union
+
+from .exceptions import DeviceError, NoResponseError, RecoverableError
+
+_LOGGER = logging.getLogger(__name__)
+
+# a request for the generator driver to send, or a blocking function to call with
+# the listed arguments, and the result or the exception
+ProbeRequest = Tuple[Union[str, Callable[..., Any]], Any]
+ProbeStep = Generator[ProbeRequest, Any, Optional[int]]
+
+
+class PropertyLimitCache:
+    """JSON file of the property limits per model and firmware version."""
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: File to keep the limits in, created on the first write
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._limits: Optional[Dict[str, int]] = None
+
+    @staticmethod
+    def key(model: str, firmware: str) -> str:
+        return "%s/%s" % (model, firmware)
+
+    def _load(self) -> Dict[str, int]:
+        if self._limits is None:
+            try:
+                with open(self.path) as f:
+                    self._limits = json.load(f)
+            except FileNotFoundError:
+                self._limits = {}
+            except (OSError, ValueError) as ex:
+                _LOGGER.warning("Ignoring unreadable %s: %s", self.path, ex)
+                self._limits = {}
+        return self._limits
+
+    def get(self, key: str) -> Optional[int]:
+        """Return the limit stored for the key, None if there is none."""
+        with self._lock:
+            return self._load().get(key)
+
+    def set(self, key: str, limit: int) -> None:
+        """Store the limit for the key, replacing the file atomically."""
+        with self._lock:
+            limits = self._load()
+            limits[key] = limit
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp = "%s.%s.tmp" % (self.path, os.getpid())
+                with open(tmp, "w") as f:
+                    json.dump(limits, f, indent=2, sort_keys=True)
+                os.replace(tmp, self.path)
+            except OSError as ex:
+                _LOGGER.warning("Unable to store %s: %s", self.path, ex)
+
+
+def _accepted(result: Any, count: int) -> Optional[bool]:
+    """Return whether a request of `count` properties was answered in full, or
+    None if the result tells nothing about the limit."""
+    if not isinstance(result, Exception):
+        return isinstance(result, list) and len(result) == count
+    # errors returned by the device for the request, unlike overloads
+    if isinstance(result, DeviceError) and not isinstance(result, RecoverableError):
+        return False
+    # a single property is within any limit, so the device is unreachable
+    if isinstance(result, NoResponseError) and count > 1:
+        return False
+    return None
+
+
+def probe_max_properties(
+    properties: List[Dict[str, Any]], cache: Optional[PropertyLimitCache] = None
+) -> ProbeStep:
+    """Find the largest number of properties the device answers per request.
+
+    This is a generator yielding the commands to send as pairs of method and
+    parameters, to which the result or the raised exception is to be sent back,
+    so that it can be driven by both the blocking and the asyncio protocol. The
+    cache is accessed through yielded pairs of a blocking function and its
+    arguments, for the asyncio driver to call them in an executor. The commands
+    are to be sent with the usual retries, as a timeout counts as a rejection.
+    It returns the limit, or None if the probing failed for other reasons than
+    the device rejecting a request, in which case nothing is cached.
+
+    All properties are requested first, so that devices without a limit need a
+    single request, then the limit is searched by bisection.
+    """
+    key = None
+    if cache is not None:
+        info = yield ("miIO.info", [])
+        if isinstance(info, Exception):
+            _LOGGER.debug("Unable to read the firmware version: %s", info)
+            return None
+        key = cache.key(info.get("model"), info.get("fw_ver"))
+        limit = yield (cache.get, [key])
+        if limit is not None:
+            return limit
+
+    low, high = 0, len(properties)
+    count = high
+    timed_out = False
+    while low < high:
+        result = yield ("get_properties", properties[:count])
+        accepted = _accepted(result, count)
+        if accepted is None:
+            return None
+        if accepted:
+            low = count
+        else:
+            high = count - 1
+            timed_out = timed_out or isinstance(result, NoResponseError)
+        count = (low + high + 1) // 2
+
+    if low == 0:
+        return None
+    _LOGGER.debug("Device accepts %s properties per request", low)
+    if key is not None and not timed_out:
+        yield (cache.set, [key, low])
+    return low
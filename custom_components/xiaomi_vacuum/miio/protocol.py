@@ -13,16 +13,21 @@ If the decryption fails, raw bytes as returned by the device are returned.
 """
 import calendar
 import datetime
+import functools
 import hashlib
 import json
 import logging
-from typing import Any, Dict, Tuple
+import struct
+from typing import Any, Dict, Iterable, Tuple, Union
 
 from construct import (
     Adapter,
     Bytes,
     Checksum,
+    ChecksumError,
     Const,
+    ConstError,
+    Container,
     Default,
     GreedyBytes,
     Hex,
@@ -35,13 +40,37 @@ from construct import (
     Struct,
 )
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
 from miio.exceptions import PayloadDecodeException
 
 _LOGGER = logging.getLogger(__name__)
 
+# use a faster JSON library when one is installed, json_loads accepts any
+# bytes-like object so that payloads can be passed as memoryview
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    try:
+        import ujson
+
+        def json_loads(data: bytes):
+            return ujson.loads(bytes(data))
+
+        def json_dumps(obj) -> bytes:
+            return ujson.dumps(obj).encode("utf-8")
+
+    except ImportError:
+
+        def json_loads(data: bytes):
+            return json.loads(str(data, "utf-8"))
+
+        def json_dumps(obj) -> bytes:
+            return json.dumps(obj).encode("utf-8")
+
 
 class Utils:
     """This class is adapted from the original xpn.py code by gst666."""
@@ -61,6 +90,14 @@ class Utils:
         checksum.update(data)
         return checksum.digest()
 
+    @staticmethod
+    def md5_chunks(chunks: Iterable[bytes]) -> bytes:
+        """Calculates a md5 hashsum over the concatenation of the given chunks."""
+        checksum = hashlib.md5()  # nosec
+        for chunk in chunks:
+            checksum.update(chunk)
+        return checksum.digest()
+
     @staticmethod
     def key_iv(token: bytes) -> Tuple[bytes, bytes]:
         """Generate an IV used for encryption based on given token."""
@@ -68,6 +105,18 @@ class Utils:
         iv = Utils.md5(key + token)
         return key, iv
 
+    @staticmethod
+    def crypto_context(token: Union[bytes, "CryptoContext"]) -> "CryptoContext":
+        """Return the :class:`CryptoContext` for the given token.
+
+        A context can be passed instead of the token wherever a token is expected,
+        which is how :class:`MiIOProtocol` avoids the lookup. Contexts created for
+        tokens are cached for the last few tokens only.
+        """
+        if isinstance(token, CryptoContext):
+            return token
+        return _cached_crypto_context(token)
+
     @staticmethod
     def encrypt(plaintext: bytes, token: bytes) -> bytes:
         """Encrypt plaintext with a given token.
@@ -76,17 +125,7 @@ class Utils:
         :param bytes token: Token to use
         :return: Encrypted bytes
         """
-        if not isinstance(plaintext, bytes):
-            raise TypeError("plaintext requires bytes")
-        Utils.verify_token(token)
-        key, iv = Utils.key_iv(token)
-        padder = padding.PKCS7(128).padder()
-
-        padded_plaintext = padder.update(plaintext) + padder.finalize()
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-
-        encryptor = cipher.encryptor()
-        return encryptor.update(padded_plaintext) + encryptor.finalize()
+        return Utils.crypto_context(token).encrypt(plaintext)
 
     @staticmethod
     def decrypt(ciphertext: bytes, token: bytes) -> bytes:
@@ -96,30 +135,16 @@ class Utils:
         :param bytes token: Token to use
         :return: Decrypted bytes object
         """
-        if not isinstance(ciphertext, bytes):
-            raise TypeError("ciphertext requires bytes")
-        Utils.verify_token(token)
-        key, iv = Utils.key_iv(token)
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-
-        decryptor = cipher.decryptor()
-        padded_plaintext = decryptor.update(ciphertext) + decryptor.finalize()
-
-        unpadder = padding.PKCS7(128).unpadder()
-        unpadded_plaintext = unpadder.update(padded_plaintext)
-        unpadded_plaintext += unpadder.finalize()
-        return unpadded_plaintext
+        return Utils.crypto_context(token).decrypt(ciphertext)
 
     @staticmethod
-    def checksum_field_bytes(ctx: Dict[str, Any]) -> bytearray:
-        """Gather bytes for checksum calculation."""
-        x = bytearray(ctx["header"].data)
-        x += ctx["_"]["token"]
+    def checksum_field_bytes(ctx: Dict[str, Any]) -> Tuple[bytes, ...]:
+        """Gather the chunks covered by the checksum, see :func:`md5_chunks`."""
+        chunks = (ctx["header"].data, Utils.crypto_context(ctx["_"]["token"]).token)
         if "data" in ctx:
-            x += ctx["data"].data
-            # print("DATA: %s" % ctx["data"])
+            chunks += (ctx["data"].data,)
 
-        return x
+        return chunks
 
     @staticmethod
     def get_length(x) -> int:
@@ -139,6 +164,76 @@ class Utils:
         return bool(val == 32)
 
 
+class CryptoContext:
+    """Key material of a device token.
+
+    The key and IV are derived from the token once and the cipher is kept, so that
+    encrypting and decrypting a message only needs a fresh encryptor or decryptor.
+    Instances are cached per token by :func:`Utils.crypto_context`, and kept per
+    device by :class:`MiIOProtocol`.
+    """
+
+    def __init__(self, token: bytes) -> None:
+        Utils.verify_token(token)
+        self.token = token
+        self.key, self.iv = Utils.key_iv(token)
+        self.cipher = Cipher(
+            algorithms.AES(self.key), modes.CBC(self.iv), backend=default_backend()
+        )
+
+    def encrypt(self, plaintext: bytes) -> bytes:
+        """Encrypt plaintext with the token.
+
+        :param bytes plaintext: Plaintext (json) to encrypt
+        :return: Encrypted bytes
+        """
+        if not isinstance(plaintext, bytes):
+            raise TypeError("plaintext requires bytes")
+        pad = 16 - len(plaintext) % 16
+        encryptor = self.cipher.encryptor()
+        ciphertext = encryptor.update(plaintext + bytes((pad,)) * pad)
+        encryptor.finalize()
+        return ciphertext
+
+    def decrypt(self, ciphertext: bytes) -> bytes:
+        """Decrypt ciphertext with the token.
+
+        :param bytes ciphertext: Ciphertext to decrypt
+        :return: Decrypted bytes object
+        """
+        if not isinstance(ciphertext, bytes):
+            raise TypeError("ciphertext requires bytes")
+        padded_plaintext, length = self.decrypt_padded(ciphertext)
+        return padded_plaintext[:length]
+
+    def decrypt_padded(self, ciphertext) -> Tuple[bytes, int]:
+        """Decrypt ciphertext with the token without removing the padding.
+
+        This avoids copying the plaintext, the padding is verified and only the
+        length of the plaintext without it is returned.
+
+        :param ciphertext: Ciphertext to decrypt, any bytes-like object
+        :return: Decrypted bytes including the padding and the plaintext length
+        :raises ValueError: if the ciphertext or the padding is invalid
+        """
+        decryptor = self.cipher.decryptor()
+        # CBC returns all complete blocks from update, finalize only verifies
+        # that no partial block was left
+        padded_plaintext = decryptor.update(ciphertext)
+        decryptor.finalize()
+
+        length = len(padded_plaintext)
+        pad = padded_plaintext[-1] if length else 0
+        if not 0 < pad <= 16 or padded_plaintext.count(pad, length - pad) != pad:
+            raise ValueError("Invalid padding bytes.")
+        return padded_plaintext, length - pad
+
+
+@functools.lru_cache(maxsize=32)
+def _cached_crypto_context(token: bytes) -> CryptoContext:
+    return CryptoContext(token)
+
+
 class TimeAdapter(Adapter):
     """Adapter for timestamp conversion."""
 
@@ -149,6 +244,24 @@ class TimeAdapter(Adapter):
         return datetime.datetime.utcfromtimestamp(obj)
 
 
+class PreparedRequest(dict):
+    """Request payload serialized in advance but for its id.
+
+    The dict holds the request for inspection, while `body` holds the JSON
+    members following the id, so that only the id is serialized per request.
+    """
+
+    __slots__ = ("body",)
+
+    def __init__(self, msg_id: int, method: str, params: Any, body: bytes) -> None:
+        super().__init__(id=msg_id, method=method, params=params)
+        self.body = body
+
+    def serialize(self) -> bytes:
+        """Return the JSON document of the request."""
+        return b'{"id":%d,%s' % (self["id"], self.body)
+
+
 class EncryptionAdapter(Adapter):
     """Adapter to handle communication encryption."""
 
@@ -158,54 +271,75 @@ class EncryptionAdapter(Adapter):
         :param obj: JSON object to encrypt
         """
         # pp(context)
-        return Utils.encrypt(
-            json.dumps(obj).encode("utf-8") + b"\x00", context["_"]["token"]
-        )
+        return EncryptionAdapter.encode_payload(obj, context["_"]["token"])
 
     def _decode(self, obj, context, path):
         """Decrypts the given payload with the token stored in the context.
 
         :return str: JSON object
         """
+        # pp(context)
+        return EncryptionAdapter.decode_payload(obj, context["_"].get("token"))
+
+    @staticmethod
+    def encode_payload(obj, token: bytes) -> bytes:
+        """Encrypt the given JSON object with the token."""
+        if isinstance(obj, PreparedRequest):
+            data = obj.serialize()
+        else:
+            data = json_dumps(obj)
+        return Utils.crypto_context(token).encrypt(data + b"\x00")
+
+    @staticmethod
+    def decode_payload(obj: bytes, token: bytes):
+        """Decrypt the given payload with the token and decode the JSON object.
+
+        If the payload cannot be decrypted, raw bytes are returned.
+        """
         try:
-            # pp(context)
-            decrypted = Utils.decrypt(obj, context["_"]["token"])
-            decrypted = decrypted.rstrip(b"\x00")
+            decrypted, length = Utils.crypto_context(token).decrypt_padded(obj)
         except Exception:
+            obj = bytes(obj)
             if obj:
                 _LOGGER.debug("Unable to decrypt, returning raw bytes: %s", obj)
             return obj
 
-        # list of adaption functions for malformed json payload (quirks)
-        decrypted_quirks = [
-            # try without modifications first
-            lambda decrypted_bytes: decrypted_bytes,
-            # powerstrip returns malformed JSON if the device is not
-            # connected to the cloud, so we try to fix it here carefully.
-            lambda decrypted_bytes: decrypted_bytes.replace(
-                b',,"otu_stat"', b',"otu_stat"'
-            ),
-            # xiaomi cloud returns malformed json when answering _sync.batch_gen_room_up_url
-            # command so try to sanitize it
-            lambda decrypted_bytes: decrypted_bytes[: decrypted_bytes.rfind(b"\x00")]
-            if b"\x00" in decrypted_bytes
-            else decrypted_bytes,
-        ]
-
-        for i, quirk in enumerate(decrypted_quirks):
-            decoded = quirk(decrypted).decode("utf-8")
-            try:
-                return json.loads(decoded)
-            except Exception as ex:
-                # log the error when decrypted bytes couldn't be loaded
-                # after trying all quirk adaptions
-                if i == len(decrypted_quirks) - 1:
-                    _LOGGER.debug("Unable to parse json '%s': %s", decoded, ex)
-                    raise PayloadDecodeException(
-                        "Unable to parse message payload"
-                    ) from ex
-
-        return None
+        decrypted = EncryptionAdapter.fix_payload(decrypted, length)
+        try:
+            return json_loads(decrypted)
+        except Exception as ex:
+            _LOGGER.debug("Unable to parse json '%s': %s", bytes(decrypted), ex)
+            raise PayloadDecodeException("Unable to parse message payload") from ex
+
+    @staticmethod
+    def fix_payload(decrypted: bytes, length: int = None):
+        """Strip the trailing NUL and repair known malformed payloads (quirks).
+
+        The payload is only scanned for the markers of the quirks. Unless the
+        powerstrip quirk needs to be fixed, no copy is made and a memoryview is
+        returned when the payload has to be shortened.
+
+        :param decrypted: Decrypted payload
+        :param length: Length of the payload in `decrypted`, all of it if None
+        :return: Bytes-like object with the JSON document
+        """
+        end = len(decrypted) if length is None else length
+        while end and decrypted[end - 1] == 0:
+            end -= 1
+        # xiaomi cloud returns malformed json when answering
+        # _sync.batch_gen_room_up_url command, cut it at the last embedded NUL
+        nul = decrypted.rfind(b"\x00", 0, end)
+        if nul != -1:
+            end = nul
+
+        # powerstrip returns malformed JSON if the device is not
+        # connected to the cloud, so we try to fix it here carefully.
+        if decrypted.find(b',,"otu_stat"', 0, end) != -1:
+            return decrypted[:end].replace(b',,"otu_stat"', b',"otu_stat"')
+
+        if end == len(decrypted):
+            return decrypted
+        return memoryview(decrypted)[:end]
 
 
 Message = Struct(
@@ -225,6 +359,109 @@ Message = Struct(
     / IfThenElse(
         Utils.is_hello,
         Bytes(16),
-        Checksum(Bytes(16), Utils.md5, Utils.checksum_field_bytes),
+        Checksum(Bytes(16), Utils.md5_chunks, Utils.checksum_field_bytes),
     ),
 )
+
+
+# length of handshake packets, which are a header without payload
+HELLO_LENGTH = 32
+
+
+class FastMessage:
+    """Hand-written codec for the miIO packet format.
+
+    This implements the same wire format as the declarative :data:`Message`
+    definition, which is kept as the reference implementation, but packs and
+    unpacks the header with :mod:`struct` instead of interpreting the construct
+    tree. :func:`build` and :func:`parse` accept and return the same structures as
+    ``Message.build`` and ``Message.parse``, and raise the same exceptions.
+    """
+
+    HEADER = struct.Struct(">HHI4sI")
+    MAGIC = 0x2131
+
+    @staticmethod
+    def build(obj: Dict[str, Any], token: bytes = None) -> bytes:
+        """Build a packet from a dict like ``Message.build`` expects it."""
+        header = obj["header"]["value"]
+        value = obj["data"]["value"]
+        if isinstance(value, bytes):
+            data = value
+        else:
+            data = EncryptionAdapter.encode_payload(value, token)
+
+        ts = header.get("ts")
+        if ts is None:
+            ts = datetime.datetime.utcnow()
+        head = FastMessage.HEADER.pack(
+            FastMessage.MAGIC,
+            len(data) + 32,
+            header.get("unknown", 0x00000000),
+            header["device_id"],
+            calendar.timegm(ts.timetuple()),
+        )
+
+        if not data:
+            return head + obj["checksum"]
+
+        checksum = Utils.md5_chunks((head, Utils.crypto_context(token).token, data))
+        return b"".join((head, checksum, data))
+
+    @staticmethod
+    def parse(data: bytes, token: bytes = None) -> Container:
+        """Parse a packet into a container like ``Message.parse`` returns it.
+
+        The packet can be any bytes-like object, such as a view into a receive
+        buffer. The checksum and the payload are computed on views of it, the
+        returned container holds copies.
+
+        :raises ChecksumError: if the checksum does not match the token
+        """
+        view = memoryview(data)
+        magic, length, unknown, device_id, ts = FastMessage.HEADER.unpack_from(view)
+        if magic != FastMessage.MAGIC:
+            raise ConstError(
+                "parsing expected %r but parsed %r" % (FastMessage.MAGIC, magic)
+            )
+
+        head = view[:16]
+        checksum = view[16:32]
+        payload = view[32:]
+        value = None
+        if length != 32:
+            expected = Utils.md5_chunks(
+                (head, Utils.crypto_context(token).token, payload)
+            )
+            if expected != checksum:
+                raise ChecksumError(
+                    "wrong checksum, read %r, computed %r"
+                    % (bytes(checksum), expected),
+                    path="(parsing) -> checksum",
+                )
+            value = EncryptionAdapter.decode_payload(payload, token)
+
+        # the packet may live in a reused receive buffer, so keep copies
+        checksum = bytes(checksum)
+        payload = bytes(payload)
+        if value is None:
+            value = payload
+
+        return Container(
+            data=Container(
+                data=payload,
+                value=value,
+                length=len(payload),
+            ),
+            header=Container(
+                data=bytes(head),
+                value=Container(
+                    length=length,
+                    unknown=unknown,
+                    device_id=device_id,
+                    ts=datetime.datetime.utcfromtimestamp(ts),
+                ),
+                length=16,
+            ),
+            checksum=checksum,
+        )
@@ -0,0 +1,123 @@
+"""Request rate limiting for miIO devices.
+
+Devices answer with a -30001 error, raised as :class:`RecoverableError`, when
+they get more requests than they can handle. :class:`RateLimiter` spaces the
+requests to a device with a token bucket and adapts its rate to such overloads:
+the rate is cut by a factor on every overload and grows back linearly with the
+successful requests (AIMD).
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token bucket limiting the requests sent to a device.
+
+    Up to `burst` requests are sent at once, further ones wait for their turn at
+    `rate` requests per second. The limiter is safe to share between threads and
+    the sync and async protocol of a device.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: int = 10,
+        *,
+        min_rate: float = 0.5,
+        increase: float = 0.1,
+        decrease: float = 0.5,
+    ) -> None:
+        """
+        :param rate: Requests per second, None to not limit the requests
+        :param burst: Requests which are sent without waiting
+        :param min_rate: Lower bound of the rate after overloads
+        :param increase: Requests per second the rate grows by per success
+        :param decrease: Factor the rate is multiplied with on an overload
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        # requests currently waiting for their turn
+        self.waiting = 0
+        # requests which had to wait
+        self.throttled = 0
+
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _reserve(self) -> float:
+        """Take a token and return the seconds to wait until it is due."""
+        if self.rate is None:
+            return 0.0
+        with self._lock:
+            self._refill()
+            # tokens go negative for the waiting requests, which keeps them in order
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            self.throttled += 1
+            self.waiting += 1
+            return -self._tokens / self.rate
+
+    def _done(self) -> None:
+        with self._lock:
+            self.waiting -= 1
+
+    def acquire(self) -> None:
+        """Block until a request may be sent."""
+        delay = self._reserve()
+        if delay:
+            try:
+                time.sleep(delay)
+            finally:
+                self._done()
+
+    async def async_acquire(self) -> None:
+        """Wait without blocking the event loop until a request may be sent."""
+        delay = self._reserve()
+        if delay:
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._done()
+
+    def overloaded(self) -> None:
+        """Reduce the rate after the device reported an overload."""
+        if self.rate is None:
+            return
+        with self._lock:
+            self._refill()
+            self.rate = max(self.rate * self.decrease, self.min_rate)
+        _LOGGER.debug("Device overloaded, reduced the rate to %.2f/s", self.rate)
+
+    def succeeded(self) -> None:
+        """Increase the rate towards its configured value after a success."""
+        if self.rate is None or self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self._refill()
+            self.rate = min(self.rate + self.increase, self.max_rate)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the current rate, the queue depth and the throttled requests."""
+        return {
+            "rate": None if self.rate is None else round(self.rate, 2),
+            "max_rate": self.max_rate,
+            "burst": self.burst,
+            "waiting": self.waiting,
+            "throttled": self.throttled,
+        }
@@ -0,0 +1,110 @@
+"""Property requests of MIoT mappings built in advance.
+
+Status polls request the same properties over and over. :class:`CompiledMapping`
+builds the property requests of a mapping once, and :class:`RequestTemplate`
+keeps the JSON document of a request serialized, so that only the message id
+is serialized when a request is sent, see :class:`PreparedRequest`.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .protocol import PreparedRequest, json_dumps
+
+# a property of a get_properties request or response, identified by its did
+PropertyRequest = Dict[str, Any]
+
+# slice templates kept per mapping, the combinations polled are few
+MAX_TEMPLATES = 64
+
+
+@dataclass(frozen=True)
+class RequestTemplate:
+    """Request of a fixed method and parameters, serialized but for the id.
+
+    Templates can be passed as the parameters of :func:`Device.send`. The
+    length of a template is the number of its parameters.
+    """
+
+    method: str
+    params: Tuple[Any, ...]
+    # the JSON members following the id
+    body: bytes
+
+    @classmethod
+    def build(cls, method: str, params: Sequence[Any]) -> "RequestTemplate":
+        """Serialize a request of the method with the parameters."""
+        params = tuple(params)
+        return cls(method, params, json_dumps({"method": method, "params": params})[1:])
+
+    def __len__(self) -> int:
+        return len(self.params)
+
+    def prepare(self, msg_id: int) -> PreparedRequest:
+        """Return the request payload with the given id."""
+        return PreparedRequest(msg_id, self.method, self.params, self.body)
+
+
+class CompiledMapping:
+    """Property requests and lookup tables of a mapping, built once.
+
+    The property requests are shared, they must not be modified.
+    """
+
+    def __init__(
+        self, mapping: Dict[str, Dict[str, Any]], method: str = "get_properties"
+    ) -> None:
+        """
+        :param mapping: MIoT mapping of the device
+        :param method: Method the properties are requested with
+        """
+        self.method = method
+        # We send property key in "did" because it's sent back via response and we can identify the property.
+        self.properties: Tuple[PropertyRequest, ...] = tuple(
+            {"did": k, **v} for k, v in mapping.items() if "aiid" not in v
+        )
+        self.by_did: Dict[str, PropertyRequest] = {
+            prop["did"]: prop for prop in self.properties
+        }
+        self._no_values = dict.fromkeys(self.by_did)
+        # templates of the slices per property ids and slice size
+        self._slices: Dict[Tuple[Tuple[int, ...], Optional[int]], list] = {}
+
+    def slices(
+        self, properties: Sequence[PropertyRequest], max_properties: Optional[int]
+    ) -> Optional[List[RequestTemplate]]:
+        """Return the templates requesting the properties in slices.
+
+        The templates are built on the first request of the same properties and
+        reused afterwards. None is returned if not all properties are of this
+        mapping.
+
+        :param properties: Property requests of :attr:`properties`
+        :param max_properties: Properties per slice, None for a single slice
+        """
+        # the property requests live as long as the mapping, so their ids are
+        # stable and identify them
+        key = (tuple(map(id, properties)), max_properties)
+        templates = self._slices.get(key)
+        if templates is None:
+            if any(self.by_did.get(prop["did"]) is not prop for prop in properties):
+                return None
+            if len(self._slices) >= MAX_TEMPLATES:
+                self._slices.clear()
+            size = max_properties or len(properties) or 1
+            templates = self._slices[key] = [
+                RequestTemplate.build(self.method, properties[i : i + size])
+                for i in range(0, len(properties), size)
+            ]
+        return templates
+
+    def decode(self, values: Sequence[PropertyRequest]) -> Dict[str, Any]:
+        """Return the values of the response by property name.
+
+        Properties which failed or are missing from the response are None.
+        """
+        decoded = self._no_values.copy()
+        for item in values:
+            did = item.get("did")
+            if item.get("code") == 0 and did in decoded:
+                decoded[did] = item.get("value")
+        return decoded
@@ -0,0 +1,130 @@
+"""Retry handling for requests to miIO devices.
+
+:class:`RetryPolicy` decides which failures are worth another attempt, how long to
+wait before it, and keeps all attempts of a call within an optional deadline.
+"""
+import asyncio
+import random
+import time
+from typing import Optional, Tuple, Type
+
+from construct.core import ChecksumError
+
+from .exceptions import (
+    DeadlineExceededError,
+    DeviceError,
+    PayloadDecodeException,
+    RecoverableError,
+)
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter, bounded by a number of retries and a deadline.
+
+    Timeouts, socket errors and :class:`RecoverableError` are retried, checksum
+    errors, payload decode errors and other errors reported by the device are not.
+    """
+
+    retryable: Tuple[Type[BaseException], ...] = (
+        RecoverableError,
+        OSError,
+        asyncio.TimeoutError,
+    )
+    fatal: Tuple[Type[BaseException], ...] = (
+        ChecksumError,
+        PayloadDecodeException,
+        DeviceError,
+    )
+
+    def __init__(
+        self,
+        retries: int = 3,
+        *,
+        backoff: float = 0.1,
+        multiplier: float = 2.0,
+        max_backoff: float = 2.0,
+        jitter: float = 0.5,
+    ) -> None:
+        """
+        :param retries: Default number of retries after the first attempt
+        :param backoff: Seconds to wait before the first retry
+        :param multiplier: Factor the wait grows with every retry
+        :param max_backoff: Upper bound of the wait in seconds
+        :param jitter: Fraction the wait is randomly varied by
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def is_retryable(self, ex: BaseException) -> bool:
+        """Return True if the request may be repeated after the given error."""
+        if isinstance(ex, RecoverableError):
+            return True
+        if isinstance(ex, self.fatal):
+            return False
+        return isinstance(ex, self.retryable)
+
+    def delay(self, retry: int) -> float:
+        """Return the seconds to wait before the given retry, starting at 1."""
+        delay = min(self.backoff * self.multiplier ** (retry - 1), self.max_backoff)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)  # nosec
+
+    def start(
+        self, retries: Optional[int] = None, deadline: Optional[float] = None
+    ) -> "RetryState":
+        """Start tracking the attempts of a call.
+
+        :param retries: Number of retries, the policy default if None
+        :param deadline: Seconds all attempts have to finish in, None for no limit
+        """
+        return RetryState(self, self.retries if retries is None else retries, deadline)
+
+
+class RetryState:
+    """Attempts of a single call made under a :class:`RetryPolicy`."""
+
+    def __init__(
+        self, policy: RetryPolicy, retries: int, deadline: Optional[float]
+    ) -> None:
+        self.policy = policy
+        self.retries = retries
+        self.attempts = 0
+        # the error of the last failed attempt
+        self.last_error: Optional[BaseException] = None
+        self._deadline = None if deadline is None else time.monotonic() + deadline
+
+    def remaining(self) -> Optional[float]:
+        """Return the seconds left until the deadline, None without a deadline."""
+        if self._deadline is None:
+            return None
+        return max(self._deadline - time.monotonic(), 0.0)
+
+    def timeout(self, timeout: float) -> float:
+        """Return the given timeout, shortened to not exceed the deadline."""
+        remaining = self.remaining()
+        return timeout if remaining is None else min(timeout, remaining)
+
+    def next_attempt(self) -> None:
+        """Record the start of an attempt.
+
+        :raises DeadlineExceededError: if the deadline has passed
+        """
+        if self.remaining() == 0.0:
+            raise DeadlineExceededError(
+                "Deadline exceeded after %s attempts" % self.attempts
+            ) from self.last_error
+        self.attempts += 1
+
+    def retry_delay(self, ex: BaseException) -> Optional[float]:
+        """Return the seconds to wait before retrying after `ex`, or None to give up."""
+        self.last_error = ex
+        if self.attempts > self.retries or not self.policy.is_retryable(ex):
+            return None
+
+        delay = self.policy.delay(self.attempts)
+        remaining = self.remaining()
+        if remaining is not None and delay >= remaining:
+            return None
+        return delay
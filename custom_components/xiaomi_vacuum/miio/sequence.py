@@ -0,0 +1,114 @@
+"""Message ids of miIO requests.
+
+Devices echo the id of a request in its response, which is how responses are
+matched to requests. :class:`IdAllocator` hands out monotonically increasing ids
+and tracks the ids of the requests awaiting a response, so that no id is reused
+while in flight and late responses to earlier requests can be told apart.
+:func:`call_waiter` shares the future awaiting the response between the attempts
+of a call.
+"""
+import threading
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    TypeVar,
+)
+
+from .protocol import Message
+
+# the future type of the blocking gateway or of the asyncio endpoint
+F = TypeVar("F")
+
+# ids wrap around to 1 after this one
+MAX_ID = 9999
+
+
+class IdAllocator:
+    """Monotonic message ids with the window of outstanding requests.
+
+    The allocator is safe to share between threads and between the sync and the
+    async protocol of a device, which keeps their ids from colliding.
+    """
+
+    def __init__(self, start_id: int = 0, max_id: int = MAX_ID) -> None:
+        """
+        :param start_id: Id after which the allocation starts
+        :param max_id: Largest id before wrapping around to 1
+        """
+        self.last = start_id
+        self.max_id = max_id
+        self.outstanding: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, msg_id: int) -> bool:
+        return msg_id in self.outstanding
+
+    def _advance(self, count: int) -> None:
+        self.last = (self.last + count - 1) % self.max_id + 1
+
+    def next_id(self) -> int:
+        """Return the next id which is not awaiting a response."""
+        with self._lock:
+            self._advance(1)
+            while self.last in self.outstanding:
+                self._advance(1)
+            return self.last
+
+    def skip(self, count: int) -> None:
+        """Skip `count` ids, used after timeouts as the device may have seen them."""
+        with self._lock:
+            self._advance(count)
+
+    @contextmanager
+    def outstanding_request(self, msg_id: int) -> Iterator[None]:
+        """Track the id as awaiting a response for the duration of the block."""
+        with self._lock:
+            self.outstanding.add(msg_id)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.outstanding.discard(msg_id)
+
+
+def message_id(m: Message) -> Optional[int]:
+    """Return the id of a parsed response, None if its payload could not be
+    decoded to a JSON object, like with a wrong token."""
+    value = m.data.value
+    return value.get("id") if isinstance(value, dict) else None
+
+
+def call_waiter(
+    pending: Dict[Hashable, F], keys: List[Hashable], create: Callable[[], F]
+) -> F:
+    """Return the future awaiting the response to any attempt of a call.
+
+    The responses to all attempts of a call are awaited until the call ends, so
+    that a late response to an earlier attempt answers the call even when it
+    arrives between two attempts. The future of the first attempt is reused
+    unless it failed, then a new one is registered for all attempts. The request
+    needs not be sent if the returned future is done already.
+
+    :param pending: Futures by the keys of the requests awaiting a response
+    :param keys: Keys of the attempts of the call, the one of this attempt last
+    :param create: Factory of a new future
+    """
+    waiter: Any = pending.get(keys[0])
+    if (
+        waiter is None
+        or waiter.cancelled()
+        or (waiter.done() and waiter.exception() is not None)
+    ):
+        waiter = create()
+        for key in keys:
+            pending[key] = waiter
+    else:
+        pending[keys[-1]] = waiter
+    return waiter
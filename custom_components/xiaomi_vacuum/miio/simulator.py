@@ -0,0 +1,521 @@
+"""Simulated Dreame vacuum for development without a robot.
+
+:class:`DeviceSimulator` answers miIO handshakes and the MIoT ``get_properties``,
+``set_properties`` and ``action`` requests of the :data:`DreameD9Mapping` on a
+local UDP port, encrypted with a configurable token. Actions move the simulated
+robot through the :class:`VacuumStatus` and :class:`OperatingMode` states the real
+one reports: cleaning drains the battery and counts time and area, returning home
+docks after a while and charging refills the battery.
+
+Latency, a limit of properties per request, recoverable ``-30001`` errors and
+dropped packets can be configured or injected, so that the client can be tested
+and benchmarked against misbehaving devices.
+
+Run ``python -m miio.simulator --help`` to start one from the command line.
+"""
+import asyncio
+import datetime
+import logging
+import random
+import threading
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import click
+
+from .dreame_const import (
+    ChargeStatus,
+    DreameD9Mapping,
+    ErrorCodes,
+    OperatingMode,
+    OperationStatus,
+    VacuumSpeed,
+    VacuumStatus,
+    WaterLevel,
+    Waterbox,
+)
+from .miot_device import MiotMapping
+from .protocol import FastMessage
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TOKEN = bytes.fromhex("00112233445566778899aabbccddeeff")
+DEFAULT_DEVICE_ID = bytes.fromhex("0badf00d")
+
+RECOVERABLE_ERROR = -30001
+METHOD_NOT_FOUND = -32601
+TOO_MANY_PROPERTIES = -5001
+# MIoT result code of properties and actions missing in the mapping
+NOT_FOUND = -4003
+
+# simulated seconds per percent of battery used while cleaning
+BATTERY_DRAIN_SECONDS = 60
+# simulated seconds per percent of battery charged
+BATTERY_CHARGE_SECONDS = 10
+LOW_BATTERY = 15
+# square meters cleaned per simulated second
+AREA_PER_SECOND = 0.2
+# simulated seconds it takes to get back to the dock
+RETURN_SECONDS = 30
+
+INITIAL_STATE: Dict[str, Any] = {
+    "property_device_status": VacuumStatus.Charging,
+    "property_device_fault": ErrorCodes.NoError,
+    "property_battery_level": 100,
+    "property_charging_state": ChargeStatus.Charging,
+    "property_operating_mode": OperatingMode.ChargingMode,
+    "property_cleaning_time": 0,
+    "property_cleaning_area": 0,
+    "property_cleaning_mode": VacuumSpeed.Standard,
+    "property_water_level": WaterLevel.Medium,
+    "property_waterbox_status": Waterbox.Present,
+    "property_operation_status": OperationStatus.OperationCompleted,
+    "property_carpet_boost": 1,
+    "property_serial_number": "SIM000000001",
+    "property_remote_control_step": "",
+    "property_clean_cloth_tip": 0,
+    "property_dnd_enabled": False,
+    "property_dnd_start_time": "22:00",
+    "property_dnd_stop_time": "08:00",
+    "property_multi_map_enabled": 1,
+    "property_audio_volume": 80,
+    "property_audio_language": "en",
+    "property_voice": "",
+    "property_timezone": "UTC",
+    "property_scheduled-clean": "",
+    "property_main_brush_left_time": 300,
+    "property_main_brush_life_level": 100,
+    "property_side_brush_left_time": 200,
+    "property_side_brush_life_level": 100,
+    "property_filter_life_level": 100,
+    "property_filter_left_time": 150,
+    "property_first-clean-time": 1600000000,
+    "property_total_clean_time": 0,
+    "property_total_clean_count": 0,
+    "property_total_clean_area": 0,
+}
+
+# operation status reported for the modes started by start_sweeping_advanced
+ADVANCED_OPERATIONS = {
+    OperatingMode.AreaClean: OperationStatus.OperationAreaClean,
+    OperatingMode.CustomAreaClean: OperationStatus.OperationCustomAreaClean,
+    OperatingMode.SpotClean: OperationStatus.OperationSpotClean,
+    OperatingMode.FastMapping: OperationStatus.OperationFastMapping,
+}
+
+CONSUMABLES = {
+    "action_reset_main_brush_life": "property_main_brush",
+    "action_reset_side_brush_life": "property_side_brush",
+    "action_reset_filter_life": "property_filter",
+}
+
+
+class _SimulatorProtocol(asyncio.DatagramProtocol):
+    """Datagram endpoint handing requests to the simulator."""
+
+    def __init__(self, simulator: "DeviceSimulator") -> None:
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self._simulator = simulator
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        response = self._simulator.handle_packet(data)
+        if response is None:
+            return
+        delay = self._simulator.latency_sample()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._send, response, addr)
+        else:
+            self._send(response, addr)
+
+    def _send(self, data: bytes, addr) -> None:
+        if self.transport is not None:
+            self.transport.sendto(data, addr)
+
+
+class DeviceSimulator:
+    """A simulated Dreame vacuum listening on a local UDP port.
+
+    The simulator runs on an event loop, either the running one with
+    :func:`start` or its own loop in a background thread with
+    :func:`start_in_thread`. Used as a context manager, it is started in a thread
+    and stopped on exit.
+    """
+
+    def __init__(
+        self,
+        token: bytes = DEFAULT_TOKEN,
+        *,
+        device_id: bytes = DEFAULT_DEVICE_ID,
+        mapping: MiotMapping = DreameD9Mapping,
+        model: str = "dreame.vacuum.p2009",
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        max_properties: Optional[int] = None,
+        error_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        time_scale: float = 1.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        """
+        :param token: Token the payloads are encrypted with
+        :param device_id: Device id reported in the handshake
+        :param mapping: MIoT mapping of the simulated properties and actions
+        :param model: Model reported by ``miIO.info``
+        :param latency: Seconds before a response is sent
+        :param jitter: Seconds the latency is randomly varied by in both directions
+        :param max_properties: Properties allowed per request, None for no limit
+        :param error_rate: Fraction of requests answered with a -30001 error
+        :param drop_rate: Fraction of requests left unanswered
+        :param time_scale: Simulated seconds per real second
+        :param seed: Seed of the random decisions, for reproducible runs
+        """
+        self.token = token
+        self.device_id = device_id
+        self.mapping = mapping
+        self.model = model
+        self.latency = latency
+        self.jitter = jitter
+        self.max_properties = max_properties
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.time_scale = time_scale
+
+        self.state: Dict[str, Any] = {
+            name: value for name, value in INITIAL_STATE.items() if name in mapping
+        }
+        # the last requests received, for inspection
+        self.requests: Deque[Dict[str, Any]] = deque(maxlen=1000)
+
+        self._random = random.Random(seed)
+        self._properties = {
+            (spec["siid"], spec["piid"]): name
+            for name, spec in mapping.items()
+            if "piid" in spec
+        }
+        self._actions = {
+            (spec["siid"], spec["aiid"]): name
+            for name, spec in mapping.items()
+            if "aiid" in spec
+        }
+        self._drop_next = 0
+        self._fail_next = 0
+        self._updated_at = time.monotonic()
+        self._cleaning_seconds = 0.0
+        self._returning_seconds = 0.0
+        self._battery_seconds = 0.0
+
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "DeviceSimulator":
+        self.start_in_thread()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """Return the address the simulator listens on."""
+        if self._transport is None:
+            raise RuntimeError("The simulator is not running")
+        return self._transport.get_extra_info("sockname")[:2]
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> Tuple[str, int]:
+        """Start answering on the running event loop, return the address."""
+        self._loop = asyncio.get_running_loop()
+        self._transport, _ = await self._loop.create_datagram_endpoint(
+            lambda: _SimulatorProtocol(self), local_addr=(host, port)
+        )
+        _LOGGER.debug("Simulator listening on %s:%s", *self.address)
+        return self.address
+
+    def start_in_thread(
+        self, host: str = "127.0.0.1", port: int = 0
+    ) -> Tuple[str, int]:
+        """Start answering on an event loop in a background thread."""
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run() -> None:
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start(host, port))
+            started.set()
+            loop.run_forever()
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="miio-simulator", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.address
+
+    def stop(self) -> None:
+        """Stop answering and close the socket."""
+        if self._transport is None:
+            return
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._transport.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+        else:
+            self._transport.close()
+        self._transport = None
+
+    def drop_next(self, count: int = 1) -> None:
+        """Leave the next `count` requests unanswered."""
+        self._drop_next += count
+
+    def fail_next(self, count: int = 1) -> None:
+        """Answer the next `count` requests with a -30001 error."""
+        self._fail_next += count
+
+    def latency_sample(self) -> float:
+        """Return the delay of the next response."""
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def handle_packet(self, data: bytes) -> Optional[bytes]:
+        """Return the response to a received packet, None to not answer."""
+        if len(data) == 32:
+            return self._build({}, handshake=True)
+
+        try:
+            request = FastMessage.parse(data, token=self.token).data.value
+        except Exception as ex:
+            # a device ignores packets it cannot decrypt, e.g. with a wrong token
+            _LOGGER.debug("Ignoring invalid packet: %s", ex)
+            return None
+        self.requests.append(request)
+
+        if self._drop_next:
+            self._drop_next -= 1
+            return None
+        if self._fail_next:
+            self._fail_next -= 1
+            return self._error(request, RECOVERABLE_ERROR, "user ack timeout")
+        if self.drop_rate and self._random.random() < self.drop_rate:
+            return None
+        if self.error_rate and self._random.random() < self.error_rate:
+            return self._error(request, RECOVERABLE_ERROR, "user ack timeout")
+
+        self._advance()
+        handler = {
+            "get_properties": self._get_properties,
+            "set_properties": self._set_properties,
+            "action": self._action,
+            "miIO.info": self._info,
+        }.get(request.get("method"))
+        if handler is None:
+            return self._error(request, METHOD_NOT_FOUND, "Method not found.")
+
+        params = request.get("params", [])
+        if (
+            request["method"].endswith("_properties")
+            and self.max_properties is not None
+            and len(params) > self.max_properties
+        ):
+            return self._error(request, TOO_MANY_PROPERTIES, "too many properties")
+
+        return self._build({"id": request["id"], "result": handler(params)})
+
+    def _build(self, payload: Dict[str, Any], handshake: bool = False) -> bytes:
+        header = {
+            "length": 0,
+            "unknown": 0,
+            "device_id": self.device_id,
+            "ts": datetime.datetime.utcnow(),
+        }
+        if handshake:
+            msg = {"data": {"value": b""}, "header": {"value": header}}
+            return FastMessage.build({**msg, "checksum": self.token})
+        msg = {"data": {"value": payload}, "header": {"value": header}, "checksum": 0}
+        return FastMessage.build(msg, token=self.token)
+
+    def _error(self, request: Dict[str, Any], code: int, message: str) -> bytes:
+        payload = {"id": request["id"], "error": {"code": code, "message": message}}
+        return self._build(payload)
+
+    def _get_properties(self, params: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        result = []
+        for param in params:
+            name = self._properties.get((param.get("siid"), param.get("piid")))
+            item = {"did": param.get("did"), "siid": param.get("siid")}
+            item["piid"] = param.get("piid")
+            if name is None or name not in self.state:
+                item["code"] = NOT_FOUND
+            else:
+                item["code"] = 0
+                item["value"] = _plain(self.state[name])
+            result.append(item)
+        return result
+
+    def _set_properties(self, params: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        result = []
+        for param in params:
+            name = self._properties.get((param.get("siid"), param.get("piid")))
+            item = {"did": param.get("did"), "siid": param.get("siid")}
+            item["piid"] = param.get("piid")
+            if name is None:
+                item["code"] = NOT_FOUND
+            else:
+                self.state[name] = param.get("value")
+                item["code"] = 0
+            result.append(item)
+        return result
+
+    def _action(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        key = (params.get("siid"), params.get("aiid"))
+        result = {"did": params.get("did"), "siid": key[0], "aiid": key[1]}
+        name = self._actions.get(key)
+        if name is None:
+            return {**result, "code": NOT_FOUND}
+
+        self._run_action(name, params.get("in") or [])
+        return {**result, "code": 0, "out": []}
+
+    def _info(self, params: Any) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "fw_ver": "1.0.0_sim",
+            "hw_ver": "Linux",
+            "mac": "00:00:00:00:00:00",
+            "token": self.token.hex(),
+            "ap": {"ssid": "simulator", "bssid": "00:00:00:00:00:00", "rssi": -40},
+            "netif": {"localIp": "127.0.0.1", "mask": "255.0.0.0", "gw": "127.0.0.1"},
+        }
+
+    def _run_action(self, name: str, params: List[Dict[str, Any]]) -> None:
+        """Apply the state transition of an action."""
+        status = self.state["property_device_status"]
+        if name == "action_start_sweeping":
+            if status != VacuumStatus.Paused:
+                self._cleaning_seconds = 0.0
+            self._set_cleaning(
+                OperatingMode.AutoCleanMode, OperationStatus.OperationAutoClean
+            )
+        elif name == "action_start_sweeping_advanced":
+            values = {param.get("piid"): param.get("value") for param in params}
+            try:
+                mode = OperatingMode(values.get(1))
+            except ValueError:
+                mode = OperatingMode.AutoCleanMode
+            self._cleaning_seconds = 0.0
+            self._set_cleaning(
+                mode,
+                ADVANCED_OPERATIONS.get(mode, OperationStatus.OperationAutoClean),
+            )
+        elif name == "action_pause_sweeping":
+            if status == VacuumStatus.Sweeping:
+                self.state["property_device_status"] = VacuumStatus.Paused
+                self.state["property_operating_mode"] = OperatingMode.PauseAndStopMode
+                self.state[
+                    "property_operation_status"
+                ] = OperationStatus.OperationSuspended
+        elif name == "action_stop_sweeping":
+            self._finish_cleaning()
+            self.state["property_device_status"] = VacuumStatus.Idle
+            self.state["property_operating_mode"] = OperatingMode.IdleMode
+        elif name == "action_start_charging":
+            if status not in (VacuumStatus.Charging, VacuumStatus.Go_charging):
+                self._finish_cleaning()
+                self._returning_seconds = 0.0
+                self.state["property_device_status"] = VacuumStatus.Go_charging
+                self.state["property_operating_mode"] = OperatingMode.BackHomeMode
+                self.state["property_charging_state"] = ChargeStatus.Go_charging
+        elif name in CONSUMABLES:
+            prefix = CONSUMABLES[name]
+            self.state[prefix + "_life_level"] = 100
+            self.state[prefix + "_left_time"] = INITIAL_STATE[prefix + "_left_time"]
+
+    def _set_cleaning(self, mode: OperatingMode, operation: OperationStatus) -> None:
+        self.state["property_device_status"] = VacuumStatus.Sweeping
+        self.state["property_operating_mode"] = mode
+        self.state["property_operation_status"] = operation
+        self.state["property_charging_state"] = ChargeStatus.Not_charging
+
+    def _finish_cleaning(self) -> None:
+        """Add the current cleaning to the totals."""
+        if self._cleaning_seconds:
+            self.state["property_total_clean_count"] += 1
+            self.state["property_total_clean_time"] += int(self._cleaning_seconds // 60)
+            self.state["property_total_clean_area"] += int(
+                self._cleaning_seconds * AREA_PER_SECOND
+            )
+            self._cleaning_seconds = 0.0
+        self.state["property_operation_status"] = OperationStatus.OperationCompleted
+
+    def _advance(self) -> None:
+        """Move the simulation forward to the current time."""
+        now = time.monotonic()
+        elapsed = (now - self._updated_at) * self.time_scale
+        self._updated_at = now
+        status = self.state["property_device_status"]
+
+        if status == VacuumStatus.Sweeping:
+            self._cleaning_seconds += elapsed
+            self.state["property_cleaning_time"] = int(self._cleaning_seconds // 60)
+            self.state["property_cleaning_area"] = int(
+                self._cleaning_seconds * AREA_PER_SECOND
+            )
+            self._change_battery(-elapsed, BATTERY_DRAIN_SECONDS)
+            if self.state["property_battery_level"] <= LOW_BATTERY:
+                self._run_action("action_start_charging", [])
+        elif status == VacuumStatus.Go_charging:
+            self._returning_seconds += elapsed
+            if self._returning_seconds >= RETURN_SECONDS:
+                self.state["property_device_status"] = VacuumStatus.Charging
+                self.state["property_operating_mode"] = OperatingMode.ChargingMode
+                self.state["property_charging_state"] = ChargeStatus.Charging
+        elif status == VacuumStatus.Charging:
+            self._change_battery(elapsed, BATTERY_CHARGE_SECONDS)
+
+    def _change_battery(self, seconds: float, seconds_per_percent: float) -> None:
+        self._battery_seconds += seconds
+        percent = int(self._battery_seconds / seconds_per_percent)
+        if percent:
+            self._battery_seconds -= percent * seconds_per_percent
+            level = self.state["property_battery_level"] + percent
+            self.state["property_battery_level"] = min(max(level, 0), 100)
+
+
+def _plain(value: Any) -> Any:
+    """Return enum members as their plain value for the JSON encoder."""
+    return int(value) if isinstance(value, IntEnum) else value
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Address to listen on")
+@click.option("--port", default=54321, type=int, help="Port to listen on")
+@click.option("--token", default=DEFAULT_TOKEN.hex(), help="Token as hex string")
+@click.option("--latency", default=0.0, type=float, help="Response delay in seconds")
+@click.option("--jitter", default=0.0, type=float, help="Delay variation in seconds")
+@click.option("--max-properties", type=int, help="Properties allowed per request")
+@click.option("--error-rate", default=0.0, type=float, help="Fraction of -30001s")
+@click.option("--drop-rate", default=0.0, type=float, help="Fraction of drops")
+@click.option("--time-scale", default=1.0, type=float, help="Simulation speed")
+def main(host, port, token, **kwargs):
+    """Run a simulated Dreame vacuum until interrupted."""
+    logging.basicConfig(level=logging.DEBUG)
+    simulator = DeviceSimulator(bytes.fromhex(token), **kwargs)
+
+    async def run():
+        address = await simulator.start(host, port)
+        click.echo("Simulating %s on %s:%s" % (simulator.model, *address))
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
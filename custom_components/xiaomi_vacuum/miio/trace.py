@@ -0,0 +1,114 @@
+"""Packet tracing for miIO devices.
+
+:class:`PacketTracer` records the packets exchanged with a device together with
+their decoded payloads. It is switched on and off at runtime through
+:attr:`PacketTracer.enabled` and only ever keeps references to data which was
+built or parsed anyway: nothing is decrypted, parsed or hex-encoded a second time,
+the raw bytes of a record are assembled only when they are asked for.
+
+Records are logged at debug level to the logger of this module, and tracing is
+on whenever that logger is enabled for debug messages, so that configuring debug
+logging shows the traffic of every device.
+"""
+import binascii
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, List, NamedTuple, Optional, Tuple, Union
+
+from construct import Container
+
+_LOGGER = logging.getLogger(__name__)
+
+SEND = ">>"
+RECV = "<<"
+
+
+class HexBytes:
+    """Log argument rendering bytes as hex only when the record is emitted."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    def __str__(self) -> str:
+        return binascii.hexlify(self.data).decode()
+
+    __repr__ = __str__
+
+
+class PacketRecord(NamedTuple):
+    """A traced packet."""
+
+    time: float
+    direction: str
+    addr: Tuple[str, int]
+    # None for handshakes
+    payload: Any
+    packet: Union[bytes, Container]
+
+    @property
+    def raw(self) -> bytes:
+        """Return the packet as sent or received."""
+        if isinstance(self.packet, Container):
+            return b"".join(
+                (self.packet.header.data, self.packet.checksum, self.packet.data.data)
+            )
+        return bytes(self.packet)
+
+    def __str__(self) -> str:
+        payload = "handshake" if self.payload is None else self.payload
+        return "%s:%s %s %s" % (self.addr[0], self.addr[1], self.direction, payload)
+
+
+class PacketTracer:
+    """Keep the last packets exchanged with a device and log them.
+
+    Disabled tracers cost a check of the log level per packet.
+    """
+
+    def __init__(self, enabled: bool = False, maxlen: int = 100) -> None:
+        """
+        :param enabled: Record packets from the start, regardless of the log level
+        :param maxlen: Number of packets to keep
+        """
+        self._enabled = enabled
+        self.records: Deque[PacketRecord] = deque(maxlen=maxlen)
+
+    @property
+    def enabled(self) -> bool:
+        """Whether packets are recorded, when switched on or debug logging is."""
+        return self._enabled or _LOGGER.isEnabledFor(logging.DEBUG)
+
+    @enabled.setter
+    def enabled(self, enabled: bool) -> None:
+        self._enabled = enabled
+
+    def record(
+        self,
+        direction: str,
+        addr: Tuple[str, int],
+        payload: Any,
+        packet: Union[bytes, Container],
+    ) -> None:
+        """Record a packet.
+
+        :param direction: :data:`SEND` or :data:`RECV`
+        :param addr: Address of the device
+        :param payload: Decoded payload of the packet
+        :param packet: Packet as built, or the parsed container of a received one
+        """
+        entry = PacketRecord(time.time(), direction, addr, payload, packet)
+        self.records.append(entry)
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("%s", entry)
+
+    def dump(self, count: Optional[int] = None) -> List[PacketRecord]:
+        """Return the last `count` records, all of them if None."""
+        records = list(self.records)
+        return records if count is None else records[-count:]
+
+    def clear(self) -> None:
+        """Forget all records."""
+        self.records.clear()
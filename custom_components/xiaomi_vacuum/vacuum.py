@@ -1,5 +1,4 @@
 """Xiaomi Vacuum"""
-from functools import partial
 import logging
 import voluptuous as vol
 import time
@@ -11,6 +10,7 @@ from .miio import DreameVacuum, DeviceException
 
 from homeassistant.const import CONF_HOST, CONF_NAME, CONF_TOKEN
 from homeassistant.helpers import config_validation as cv, entity_platform
+from homeassistant.helpers.storage import STORAGE_DIR
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -39,6 +39,7 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
     # Create handler
     _LOGGER.info("Initializing with host %s (token %s...)", host, token[:5])
     vacuum = DreameVacuum(host, token)
+    vacuum.max_properties_cache = hass.config.path(STORAGE_DIR, MAX_PROPERTIES_CACHE)
 
     mirobo = MiroboVacuum(name, vacuum, no_sleep_when_docked)
     hass.data[DATA_KEY][host] = mirobo
@@ -206,6 +207,9 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
 class MiroboVacuum(StateVacuumEntity):
     """Representation of a Xiaomi Vacuum cleaner robot."""
 
+    # the counters change on every update, keep them out of the recorder
+    _unrecorded_attributes = frozenset({ATTR_PROTOCOL_STATS})
+
     def __init__(self, name, vacuum, no_sleep_when_docked):
         """Initialize the Xiaomi vacuum cleaner robot handler."""
         self._name = name
@@ -411,7 +415,20 @@ class MiroboVacuum(StateVacuumEntity):
                         ),
                     )
                 ),
+                ATTR_PROTOCOL_STATS: self._protocol_stats(),
+            }
+
+    def _protocol_stats(self):
+        """Return the protocol counters and round-trip time summaries."""
+        stats = self._vacuum.stats()
+        stats["rtt"] = {
+            method: {
+                key: rtt[key]
+                for key in ("count", "mean_ms", "p50_ms", "p90_ms", "max_ms")
             }
+            for method, rtt in stats["rtt"].items()
+        }
+        return stats
 
     @property
     def supported_features(self):
@@ -421,31 +438,50 @@ class MiroboVacuum(StateVacuumEntity):
     async def _try_command(self, mask_error, func, *args, **kwargs):
         """Call a vacuum command handling error messages."""
         try:
-            await self.hass.async_add_executor_job(partial(func, *args, **kwargs))
-            return True
+            await func(*args, **kwargs)
         except DeviceException as exc:
             _LOGGER.error(mask_error, exc)
             return False
+        # show the settings written right away instead of after the next poll
+        state = self._vacuum.cached_status()
+        if state is not None:
+            self._apply_status(state)
+            self.async_write_ha_state()
+        return True
+
+    async def _try_set_properties(self, mask_error, func, *args, **kwargs):
+        """Call a vacuum command setting several properties in one request,
+        logging the properties the device did not set."""
+
+        async def set_properties():
+            codes = await func(*args, **kwargs)
+            for key, code in codes.items():
+                if code != 0:
+                    _LOGGER.error(mask_error, "%s failed with code %s" % (key, code))
+
+        return await self._try_command(mask_error, set_properties)
 
     async def async_locate(self, **kwargs):
         """Locate the vacuum cleaner."""
-        await self._try_command("Unable to locate the botvac: %s", self._vacuum.locate)
+        await self._try_command(
+            "Unable to locate the botvac: %s", self._vacuum.async_locate
+        )
 
     async def async_start(self):
         """Start or resume the cleaning task."""
         await self._try_command(
-            "Unable to start the vacuum: %s", self._vacuum.start_sweep
+            "Unable to start the vacuum: %s", self._vacuum.async_start_sweep
         )
 
     async def async_stop(self, **kwargs):
         """Stop the vacuum cleaner."""
-        await self._try_command("Unable to stop: %s", self._vacuum.stop_sweeping)
+        await self._try_command("Unable to stop: %s", self._vacuum.async_stop_sweeping)
 
     async def async_clean_zone(self, zone, repeats):
         """Clean selected area."""
         await self._try_command(
             "Unable to send zoned_clean command to the vacuum: %s",
-            self._vacuum.zone_cleanup,
+            self._vacuum.async_zone_cleanup,
             zone,
             repeats,
         )
@@ -454,7 +490,7 @@ class MiroboVacuum(StateVacuumEntity):
         """Clean selected room using id."""
         await self._try_command(
             "Unable to send room_cleanup_by_id command to the vacuum: %s",
-            self._vacuum.room_cleanup_by_id,
+            self._vacuum.async_room_cleanup_by_id,
             rooms,
             repeats,
             clean_mode,
@@ -465,7 +501,7 @@ class MiroboVacuum(StateVacuumEntity):
         """Create restricted zone."""
         await self._try_command(
             "Unable to send set_restricted_zone command to the vacuum: %s",
-            self._vacuum.set_restricted_zone,
+            self._vacuum.async_set_restricted_zone,
             walls,
             zones,
             mops,
@@ -477,7 +513,7 @@ class MiroboVacuum(StateVacuumEntity):
         """Remote control the robot."""
         await self._try_command(
             "Unable to send remote control step command to the vacuum: %s",
-            self._vacuum.remote_control_step,
+            self._vacuum.async_remote_control_step,
             rotation,
             velocity,
         )
@@ -486,32 +522,34 @@ class MiroboVacuum(StateVacuumEntity):
         """Reset filter life."""
         await self._try_command(
             "Unable to send reset_filter_life command to the vacuum: %s",
-            self._vacuum.reset_filter_life,
+            self._vacuum.async_reset_filter_life,
         )
 
     async def async_reset_main_brush_life(self):
         """Reset filter life."""
         await self._try_command(
             "Unable to send reset_main_brush_life command to the vacuum: %s",
-            self._vacuum.reset_brush_life,
+            self._vacuum.async_reset_brush_life,
         )
 
     async def async_reset_side_brush_life(self):
         """Reset filter life."""
         await self._try_command(
             "Unable to send reset_side_brush_life command to the vacuum: %s",
-            self._vacuum.reset_side_brush_life,
+            self._vacuum.async_reset_side_brush_life,
         )
 
     async def async_pause(self):
         """Pause the cleaning task."""
         await self._try_command(
-            "Unable to set start/pause: %s", self._vacuum.pause_sweeping
+            "Unable to set start/pause: %s", self._vacuum.async_pause_sweeping
         )
 
     async def async_return_to_base(self, **kwargs):
         """Set the vacuum cleaner to return to the dock."""
-        await self._try_command("Unable to return home: %s", self._vacuum.return_home)
+        await self._try_command(
+            "Unable to return home: %s", self._vacuum.async_return_home
+        )
 
     async def async_set_fan_speed(self, fan_speed, **kwargs):
         """Set fan speed."""
@@ -528,19 +566,22 @@ class MiroboVacuum(StateVacuumEntity):
                 )
                 return
         await self._try_command(
-            "Unable to set fan speed: %s", self._vacuum.set_fan_speed, fan_speed
+            "Unable to set fan speed: %s", self._vacuum.async_set_fan_speed, fan_speed
         )
 
     async def async_select_map(self, map_id):
         """Switch selected map."""
         await self._try_command(
-            "Unable to switch to selected map: %s", self._vacuum.select_map, map_id
+            "Unable to switch to selected map: %s",
+            self._vacuum.async_select_map,
+            map_id,
         )
 
     async def async_fast_map(self):
         """Fast map."""
         await self._try_command(
-            "Unable to send fast_map command to the vacuum: %s", self._vacuum.fast_map
+            "Unable to send fast_map command to the vacuum: %s",
+            self._vacuum.async_fast_map,
         )
 
     async def async_set_water_level(self, water_level, **kwargs):
@@ -558,7 +599,9 @@ class MiroboVacuum(StateVacuumEntity):
                 )
                 return
         await self._try_command(
-            "Unable to set water level: %s", self._vacuum.set_water_level, water_level
+            "Unable to set water level: %s",
+            self._vacuum.async_set_water_level,
+            water_level,
         )
 
     async def async_multi_map(self, multi_map_enabled=""):
@@ -568,7 +611,7 @@ class MiroboVacuum(StateVacuumEntity):
         ):
             await self._try_command(
                 "Unable to set multi map: %s",
-                self._vacuum.set_multi_map,
+                self._vacuum.async_set_multi_map,
                 multi_map_enabled,
             )
 
@@ -576,35 +619,35 @@ class MiroboVacuum(StateVacuumEntity):
         """Rename a map"""
         if map_id != "" and map_name != "":
             await self._try_command(
-                "Unable to rename map: %s", self._vacuum.rename_map, map_id, map_name
+                "Unable to rename map: %s",
+                self._vacuum.async_rename_map,
+                map_id,
+                map_name,
             )
 
     async def async_do_not_disturb(self, dnd_enabled="", dnd_start="", dnd_stop=""):
         """Set do not disturb function"""
+        settings = {}
         if dnd_enabled != "" and (
             bool(dnd_enabled) == True or bool(dnd_enabled) == False
         ):
-            await self._try_command(
-                "Unable to set DnD mode: %s", self._vacuum.set_dnd, dnd_enabled
-            )
+            settings["enabled"] = dnd_enabled
         if dnd_start:
             if re.match(self.time_pattern, dnd_start):
-                await self._try_command(
-                    "Unable to set DnD start time: %s",
-                    self._vacuum.set_dnd_start,
-                    dnd_start,
-                )
+                settings["start"] = dnd_start
             else:
                 _LOGGER.error("DnD start time is not valid: (%s).", dnd_start)
         if dnd_stop:
             if re.match(self.time_pattern, dnd_stop):
-                await self._try_command(
-                    "Unable to set DnD stop time: %s",
-                    self._vacuum.set_dnd_stop,
-                    dnd_stop,
-                )
+                settings["stop"] = dnd_stop
             else:
                 _LOGGER.error("DnD stop time is not valid: (%s).", dnd_stop)
+        if settings:
+            await self._try_set_properties(
+                "Unable to set DnD settings: %s",
+                self._vacuum.async_set_dnd_settings,
+                **settings,
+            )
 
     async def async_set_carpet_boost(self, carpet_boost_enabled):
         """Enable or disable carpet boost function"""
@@ -613,7 +656,7 @@ class MiroboVacuum(StateVacuumEntity):
         ):
             await self._try_command(
                 "Unable to set carpet boost mode: %s",
-                self._vacuum.set_carpet_boost,
+                self._vacuum.async_set_carpet_boost,
                 carpet_boost_enabled,
             )
 
@@ -621,18 +664,18 @@ class MiroboVacuum(StateVacuumEntity):
         """Set audio volume"""
         await self._try_command(
             "Unable to set the volume: %s",
-            self._vacuum.set_audio_volume,
+            self._vacuum.async_set_audio_volume,
             volume,
         )
         await self._try_command(
-            "Unable to play the sound test: %s", self._vacuum.test_sound
+            "Unable to play the sound test: %s", self._vacuum.async_test_sound
         )
 
     async def async_install_voice_pack(self, lang_id, url, md5, size, **kwargs):
         """install a custom language pack"""
         await self._try_command(
             "Unable to install language pack: %s",
-            self._vacuum.install_voice_pack,
+            self._vacuum.async_install_voice_pack,
             lang_id,
             url,
             md5,
@@ -643,72 +686,83 @@ class MiroboVacuum(StateVacuumEntity):
         """Set reminder delay for cleaning mop, 0 to disable the tip"""
         await self._try_command(
             "Unable to set clean cloth reminder's delay pack: %s",
-            self._vacuum.set_cloth_cleaning_tip,
+            self._vacuum.async_set_cloth_cleaning_tip,
             delay,
         )
 
-    def update(self):
+    async def async_added_to_hass(self):
+        """Keep the device handshake fresh for commands."""
+        await self._vacuum.async_start_keepalive()
+
+    async def async_will_remove_from_hass(self):
+        """Release the device transport."""
+        self._vacuum.close()
+
+    async def async_update(self):
         """Fetch state from the device."""
         try:
-            state = self._vacuum.status()
-            if (
-                not self._no_sleep_when_docked
-                or state.status != VacuumStatus.Idle
-                or self.vacuum_state != VacuumStatus.Charging
-            ):
-                self.vacuum_last_state = self.vacuum_state
-                self.vacuum_state = state.status
-            self.vacuum_error = state.error
+            state = await self._vacuum.async_status()
+            self._apply_status(state)
+        except OSError as exc:
+            _LOGGER.error("Got OSError while fetching the state: %s", exc)
 
-            self._fan_speeds = SPEED_CODE_TO_NAME
-            self._fan_speeds_reverse = {v: k for k, v in self._fan_speeds.items()}
+    def _apply_status(self, state):
+        """Update the entity attributes from a status of the vacuum."""
+        if (
+            not self._no_sleep_when_docked
+            or state.status != VacuumStatus.Idle
+            or self.vacuum_state != VacuumStatus.Charging
+        ):
+            self.vacuum_last_state = self.vacuum_state
+            self.vacuum_state = state.status
+        self.vacuum_error = state.error
 
-            self.battery_percentage = state.battery
+        self._fan_speeds = SPEED_CODE_TO_NAME
+        self._fan_speeds_reverse = {v: k for k, v in self._fan_speeds.items()}
 
-            self._total_clean_count = state.total_clean_count
-            self._total_clean_time = state.total_clean_time
-            self._total_log_start = state.total_log_start
-            self._total_clean_area = state.total_clean_area
+        self.battery_percentage = state.battery
 
-            self._current_fan_speed = state.fan_speed
+        self._total_clean_count = state.total_clean_count
+        self._total_clean_time = state.total_clean_time
+        self._total_log_start = state.total_log_start
+        self._total_clean_area = state.total_clean_area
 
-            self._main_brush_time_left = state.main_brush_left_time
-            self._main_brush_life_level = state.main_brush_life_level
+        self._current_fan_speed = state.fan_speed
 
-            self._side_brush_time_left = state.side_brush_left_time
-            self._side_brush_life_level = state.side_brush_life_level
+        self._main_brush_time_left = state.main_brush_left_time
+        self._main_brush_life_level = state.main_brush_life_level
 
-            self._filter_life_level = state.filter_life_level
-            self._filter_left_time = state.filter_left_time
+        self._side_brush_time_left = state.side_brush_left_time
+        self._side_brush_life_level = state.side_brush_life_level
 
-            self._cleaning_area = state.cleaning_area
-            self._cleaning_time = state.cleaning_time
+        self._filter_life_level = state.filter_life_level
+        self._filter_left_time = state.filter_left_time
 
-            self._waterbox_status = state.waterbox_status
-            self._water_level = WATER_CODE_TO_NAME
-            self._water_level_reverse = {v: k for k, v in self._water_level.items()}
-            self._current_water_level = state.water_level
+        self._cleaning_area = state.cleaning_area
+        self._cleaning_time = state.cleaning_time
 
-            self._operation_status = state.operation_status
-            self._operating_mode = state.operating_mode
-            self._schedule = state.schedule if state.schedule is not None else ""
+        self._waterbox_status = state.waterbox_status
+        self._water_level = WATER_CODE_TO_NAME
+        self._water_level_reverse = {v: k for k, v in self._water_level.items()}
+        self._current_water_level = state.water_level
 
-            self._carpet_boost = state.carpet_boost
+        self._operation_status = state.operation_status
+        self._operating_mode = state.operating_mode
+        self._schedule = state.schedule if state.schedule is not None else ""
 
-            self._multi_map_enabled = state.multi_map_enabled
+        self._carpet_boost = state.carpet_boost
 
-            self._dnd_enabled = state.dnd_enabled
-            self._dnd_start_time = state.dnd_start_time
-            self._dnd_stop_time = state.dnd_stop_time
+        self._multi_map_enabled = state.multi_map_enabled
 
-            self._audio_volume = state.audio_volume
-            self._audio_language = state.audio_language
+        self._dnd_enabled = state.dnd_enabled
+        self._dnd_start_time = state.dnd_start_time
+        self._dnd_stop_time = state.dnd_stop_time
 
-            self._timezone = state.timezone
+        self._audio_volume = state.audio_volume
+        self._audio_language = state.audio_language
 
-            self._clean_cloth_tip = state.clean_cloth_tip
+        self._timezone = state.timezone
 
-            self._serial_number = state.serial_number
+        self._clean_cloth_tip = state.clean_cloth_tip
 
-        except OSError as exc:
-            _LOGGER.error("Got OSError while fetching the state: %s", exc)
+        self._serial_number = state.serial_number
@@ -0,0 +1,67 @@
+"""Check that FastMessage builds and parses the same packets as Message."""
+import datetime
+
+import pytest
+
+from miio.miioprotocol import HELLO_BYTES
+from miio.protocol import FastMessage, Message
+
+TOKEN = bytes.fromhex("00112233445566778899aabbccddeeff")
+DEVICE_ID = bytes.fromhex("0badf00d")
+TS = datetime.datetime(2021, 1, 1, 12, 30, 15)
+HEADER_FIELDS = ("length", "unknown", "device_id", "ts")
+
+COMMANDS = [
+    {"id": 1, "method": "miIO.info", "params": []},
+    {
+        "id": 4242,
+        "method": "get_properties",
+        "params": [{"did": "battery_level", "siid": 3, "piid": 1}] * 15,
+    },
+    {"id": 65535, "method": "action", "params": {"did": "call-7-1", "in": ["é"]}},
+    {"id": 7, "result": [{"did": "state", "code": 0, "value": 6}]},
+]
+
+
+def _message(value, checksum=0):
+    header = {"length": 0, "unknown": 0, "device_id": DEVICE_ID, "ts": TS}
+    return {
+        "data": {"value": value},
+        "header": {"value": header},
+        "checksum": checksum,
+    }
+
+
+def _assert_same(fast, reference):
+    for field in HEADER_FIELDS:
+        assert fast.header.value[field] == reference.header.value[field]
+    assert bytes(fast.checksum) == bytes(reference.checksum)
+    assert fast.data.value == reference.data.value
+
+
+def test_parse_hello():
+    _assert_same(FastMessage.parse(HELLO_BYTES), Message.parse(HELLO_BYTES))
+
+
+@pytest.mark.parametrize("checksum", [TOKEN, b"\xff" * 16])
+def test_handshake_response(checksum):
+    # Message encrypts any payload, so it only parses handshake responses
+    packet = FastMessage.build(_message(b"", checksum), token=TOKEN)
+    assert len(packet) == 32
+    reference = Message.parse(packet, token=TOKEN)
+    _assert_same(FastMessage.parse(packet, token=TOKEN), reference)
+
+    rebuilt = _message(b"", bytes(reference.checksum))
+    rebuilt["header"]["value"]["ts"] = reference.header.value.ts
+    assert FastMessage.build(rebuilt, token=TOKEN) == packet
+
+
+@pytest.mark.parametrize("command", COMMANDS)
+def test_encrypted_command(command):
+    obj = _message(command)
+    packet = Message.build(obj, token=TOKEN)
+    assert FastMessage.build(obj, token=TOKEN) == packet
+
+    fast = FastMessage.parse(packet, token=TOKEN)
+    _assert_same(fast, Message.parse(packet, token=TOKEN))
+    assert fast.data.value == command